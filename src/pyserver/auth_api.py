@@ -6,21 +6,38 @@ WiFi认证API服务器 - 提供RESTful API接口
 """
 
 import json
+import hmac
+import atexit
+import time
 import sqlite3
-import hashlib
+import secrets
 import logging
-from datetime import datetime, timedelta
-from flask import Flask, request, jsonify, Response, make_response
+import logging.handlers
+import queue
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from datetime import datetime
+from flask import Flask, request, Response, make_response
 from flask_cors import CORS
 from typing import Dict, Optional, Tuple
 import os
 import sys
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # 添加父目录到路径，以便导入DeviceManager
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+# 日志后台写入线程（保持模块级引用，防止被回收）
+_log_listener: Optional[logging.handlers.QueueListener] = None
+
 def setup_logging():
-    """配置日志记录"""
+    """配置日志记录（请求线程只入队，文件与控制台输出由后台线程完成）"""
+    global _log_listener
     log_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '..', 'logs')
     os.makedirs(log_dir, exist_ok=True)
     log_file = os.path.join(log_dir, 'auth_api.log')
@@ -44,8 +61,11 @@ def setup_logging():
     
     # 如果没有处理器，则添加
     if not root_logger.handlers:
-        root_logger.addHandler(file_handler)
-        root_logger.addHandler(console_handler)
+        log_queue = queue.Queue(-1)
+        root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        _log_listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler)
+        _log_listener.start()
+        atexit.register(_log_listener.stop)
 
 setup_logging()
 logger = logging.getLogger(__name__)
@@ -54,6 +74,26 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)  # 允许跨域请求
 
+def ojsonify(obj, status=200):
+    """JSON响应（优先使用orjson编码，未安装时回退到标准库json）"""
+    if orjson is not None:
+        body = orjson.dumps(obj, option=orjson.OPT_NAIVE_UTC)
+    else:
+        body = json.dumps(obj, ensure_ascii=False, default=str)
+    return Response(body, status=status, mimetype='application/json')
+
+def parse_json():
+    """解析JSON请求体（非JSON请求或解析失败时返回None，不缓存原始数据）"""
+    if not request.is_json:
+        return None
+    raw = request.get_data(cache=False)
+    if not raw:
+        return None
+    try:
+        return orjson.loads(raw) if orjson is not None else json.loads(raw)
+    except ValueError:
+        return None
+
 # 配置
 AUTH_CONFIG = {
     'valid_credentials': {
@@ -61,15 +101,171 @@ AUTH_CONFIG = {
     },
     'session_duration': 3600,  # 会话持续时间（秒）
     'max_login_attempts': 5,   # 最大登录尝试次数
-    'lockout_duration': 300    # 锁定时间（秒）
+    'lockout_duration': 300,   # 锁定时间（秒）
+    'activity_flush_interval': 5,  # 最后活动时间批量写入间隔（秒）
+    'maintenance_interval': 3600,  # 过期数据清理间隔（秒）
+    'login_log_retention': 7 * 24 * 3600  # 登录记录保留时长（秒）
 }
 
+# 热路径常用配置项
+_SESSION_DURATION = AUTH_CONFIG['session_duration']
+_MAX_LOGIN_ATTEMPTS = AUTH_CONFIG['max_login_attempts']
+_LOCKOUT_DURATION = AUTH_CONFIG['lockout_duration']
+
+# 预编码的凭据表：用户名 -> 密码字节串（供常量时间比较）
+_CREDS: Dict[str, bytes] = {u: p.encode('utf-8') for u, p in AUTH_CONFIG['valid_credentials'].items()}
+
+# 时间列统一存储为 INTEGER（Unix 秒）
+_EPOCH_NOW = "(CAST(strftime('%s', 'now') AS INTEGER))"
+
+# 旧版本以ISO字符串存储的时间列及其时区：'utc' 表示原值为本地时间，需要换算
+_LEGACY_TIME_COLUMNS = (
+    ('login_attempts', 'timestamp', None),
+    ('ip_lockouts', 'locked_until', 'utc'),
+    ('devices', 'first_seen', 'utc'),
+    ('devices', 'last_seen', 'utc'),
+    ('devices', 'auth_expires', 'utc'),
+    ('device_sessions', 'created_at', None),
+    ('device_sessions', 'expires_at', 'utc'),
+    ('device_sessions', 'last_activity', 'utc'),
+)
+
+# 运行期复用的SQL语句，配合连接的语句缓存避免重复解析
+_SQL_INSERT_ATTEMPT = '''
+    INSERT INTO login_attempts (ip_address, username, success, timestamp, user_agent)
+    VALUES (?, ?, ?, ?, ?)
+'''
+_SQL_COUNT_FAILURES = '''
+    SELECT COUNT(*) FROM login_attempts
+    WHERE ip_address = ? AND success = FALSE AND timestamp > ?
+'''
+_SQL_GET_LOCKOUT = 'SELECT locked_until FROM ip_lockouts WHERE ip_address = ? AND locked_until > ?'
+_SQL_UPSERT_LOCKOUT = '''
+    INSERT OR REPLACE INTO ip_lockouts (ip_address, locked_until, attempts_count)
+    VALUES (?, ?, ?)
+'''
+_SQL_UPSERT_DEVICE = '''
+    INSERT INTO devices
+    (ip_address, user_agent, first_seen, last_seen, is_authenticated, auth_expires)
+    VALUES (?, ?, ?, ?, 1, ?)
+    ON CONFLICT(ip_address) DO UPDATE SET
+        user_agent = excluded.user_agent,
+        last_seen = excluded.last_seen,
+        is_authenticated = 1,
+        auth_expires = excluded.auth_expires
+'''
+# 停用会话时由触发器 trg_session_deactivated 同步重置 devices 表的认证状态
+_SQL_DEACTIVATE_SESSIONS = '''
+    UPDATE device_sessions SET is_active = 0 WHERE ip_address = ? AND is_active = 1
+'''
+_SQL_INSERT_SESSION = '''
+    INSERT INTO device_sessions (ip_address, session_token, expires_at, last_activity)
+    VALUES (?, ?, ?, ?)
+'''
+_SQL_VERIFY_SESSION = '''
+    SELECT expires_at FROM device_sessions
+    WHERE session_token = ? AND ip_address = ? AND is_active = 1 AND expires_at > ?
+'''
+_SQL_UPDATE_ACTIVITY = 'UPDATE device_sessions SET last_activity = ? WHERE session_token = ?'
+_SQL_PRUNE_ATTEMPTS = 'DELETE FROM login_attempts WHERE timestamp < ?'
+_SQL_PRUNE_LOCKOUTS = 'DELETE FROM ip_lockouts WHERE locked_until <= ?'
+_SQL_LIST_DEVICES = '''
+    SELECT ip_address, user_agent, first_seen, last_seen, is_authenticated, auth_expires
+    FROM devices
+    ORDER BY last_seen DESC
+    LIMIT 100
+'''
+_SQL_LIST_LOGS = '''
+    SELECT ip_address, username, success, timestamp, user_agent
+    FROM login_attempts
+    ORDER BY timestamp DESC
+    LIMIT ? OFFSET ?
+'''
+
+class _ConnectionPool:
+    """线程安全的SQLite连接池：一个读写连接 + 若干只读连接。
+    WAL模式下读操作不会被写锁阻塞，只读连接走独立的队列。
+    """
+
+    # 每个连接建立后执行一次的PRAGMA
+    PRAGMAS = (
+        'PRAGMA synchronous=NORMAL;',
+        'PRAGMA temp_store=MEMORY;',
+        'PRAGMA cache_size=-64000;',
+        'PRAGMA busy_timeout=5000;',
+        'PRAGMA mmap_size=268435456;',  # 256MiB 内存映射读取，减少页拷贝
+    )
+
+    def __init__(self, db_path: str, pool_size: int = 8):
+        self.db_path = db_path
+        # 唯一的读写连接，由锁串行化
+        self._rw_conn = self._make_conn()
+        self._rw_conn.execute('PRAGMA journal_mode=WAL;')
+        self._rw_lock = threading.Lock()
+        # 只读连接池
+        self._ro_uri = Path(os.path.abspath(db_path)).as_uri() + '?mode=ro'
+        self._ro_pool = queue.Queue(maxsize=pool_size)
+        for _ in range(pool_size):
+            conn = self._make_conn(read_only=True)
+            conn.execute('PRAGMA query_only=1;')
+            self._ro_pool.put(conn)
+
+    def _make_conn(self, read_only: bool = False) -> sqlite3.Connection:
+        # isolation_level=None：由调用方显式 BEGIN IMMEDIATE，避免模块自动插入事务
+        # cached_statements：常驻连接的预编译语句缓存
+        if read_only:
+            conn = sqlite3.connect(self._ro_uri, uri=True, timeout=10, check_same_thread=False,
+                                   isolation_level=None, cached_statements=256)
+        else:
+            conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False,
+                                   isolation_level=None, cached_statements=256)
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def reader(self):
+        """借出一个只读连接，使用完毕后归还"""
+        conn = self._ro_pool.get()
+        try:
+            yield conn
+        finally:
+            self._ro_pool.put(conn)
+
+    @contextmanager
+    def writer(self):
+        """独占读写连接；异常时回滚未提交的事务"""
+        with self._rw_lock:
+            try:
+                yield self._rw_conn
+            except Exception:
+                self._rw_conn.rollback()
+                raise
+
 class AuthManager:
     """认证管理器"""
     
-    def __init__(self, db_path: str = "wifi_auth.db"):
+    def __init__(self, db_path: str = "wifi_auth.db", pool_size: int = 8):
         self.db_path = db_path
+        # IP锁定状态的内存镜像：ip -> 锁定截止时间（epoch秒）
+        self._lockouts: Dict[str, int] = {}
+        self._lockout_lock = threading.RLock()
         self.init_database()
+        self._pool = _ConnectionPool(db_path, pool_size)
+        # 会话最后活动时间缓冲区：token -> 时间（epoch秒），由后台线程定期批量写入
+        self._activity_buffer: Dict[str, int] = {}
+        self._activity_lock = threading.Lock()
+        threading.Thread(target=self._activity_flush_loop, name='activity-flush', daemon=True).start()
+        atexit.register(self.flush_activity)
+        threading.Thread(target=self._maintenance_loop, name='db-maintenance', daemon=True).start()
+
+    def read_conn(self):
+        """获取只读连接（上下文管理器）"""
+        return self._pool.reader()
+
+    def write_conn(self):
+        """获取读写连接（上下文管理器）"""
+        return self._pool.writer()
     
     def init_database(self):
         """初始化数据库"""
@@ -86,17 +282,17 @@ class AuthManager:
                     ip_address TEXT NOT NULL,
                     username TEXT NOT NULL,
                     success BOOLEAN NOT NULL,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    timestamp INTEGER DEFAULT {now},
                     user_agent TEXT
                 )
-            ''')
+            '''.format(now=_EPOCH_NOW))
             
             # 创建IP锁定表
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS ip_lockouts (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     ip_address TEXT UNIQUE NOT NULL,
-                    locked_until TIMESTAMP NOT NULL,
+                    locked_until INTEGER NOT NULL,
                     attempts_count INTEGER DEFAULT 0
                 )
             ''')
@@ -107,12 +303,12 @@ class AuthManager:
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     ip_address TEXT UNIQUE NOT NULL,
                     user_agent TEXT,
-                    first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    first_seen INTEGER DEFAULT {now},
+                    last_seen INTEGER DEFAULT {now},
                     is_authenticated BOOLEAN DEFAULT 0,
-                    auth_expires TIMESTAMP
+                    auth_expires INTEGER
                 )
-            ''')
+            '''.format(now=_EPOCH_NOW))
             
             # 创建设备会话表 - 基于IP地址
             cursor.execute('''
@@ -120,213 +316,255 @@ class AuthManager:
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     ip_address TEXT NOT NULL,
                     session_token TEXT UNIQUE NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    expires_at TIMESTAMP NOT NULL,
+                    created_at INTEGER DEFAULT {now},
+                    expires_at INTEGER NOT NULL,
                     is_active BOOLEAN DEFAULT 1,
-                    last_activity TIMESTAMP
+                    last_activity INTEGER
                 )
+            '''.format(now=_EPOCH_NOW))
+            
+            # 将旧库中的ISO字符串时间转换为Unix秒
+            for table, column, modifier in _LEGACY_TIME_COLUMNS:
+                args = f"{column}, '{modifier}'" if modifier else column
+                cursor.execute(f'''
+                    UPDATE {table}
+                    SET {column} = CAST(strftime('%s', {args}) AS INTEGER)
+                    WHERE typeof({column}) = 'text'
+                ''')
+            
+            # 热点查询索引（session_token 与 ip_lockouts.ip_address 已由 UNIQUE 约束自动建索引）
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_attempts_ip_time
+                ON login_attempts(ip_address, success, timestamp)
+            ''')
+            # 仅索引有效会话的部分索引：覆盖代理端认证查询与按IP停用会话，
+            # 已停用的历史会话不进入索引，B树规模只随在线设备数增长
+            cursor.execute('DROP INDEX IF EXISTS idx_sessions_ip')
+            cursor.execute('DROP INDEX IF EXISTS idx_sessions_ip_active_exp')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_sessions_active_ip_exp
+                ON device_sessions(ip_address, expires_at, is_active) WHERE is_active = 1
+            ''')
+            
+            # 会话停用时同步设备认证状态，调用方只需一条UPDATE
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_session_deactivated
+                AFTER UPDATE OF is_active ON device_sessions
+                WHEN NEW.is_active = 0
+                BEGIN
+                    UPDATE devices SET is_authenticated = 0, auth_expires = NULL
+                    WHERE ip_address = NEW.ip_address;
+                END
             ''')
             
             conn.commit()
+            
+            # 载入仍在锁定期内的IP
+            cursor.execute('''
+                SELECT ip_address, locked_until FROM ip_lockouts
+                WHERE locked_until > ?
+            ''', (int(time.time()),))
+            with self._lockout_lock:
+                self._lockouts.update(cursor.fetchall())
+            
             conn.close()
             logger.info("认证数据库初始化完成，已启用WAL模式")
         except Exception as e:
-            logger.error(f"数据库初始化失败: {e}")
+            logger.error("数据库初始化失败: %s", e)
             sys.exit(1)
     
 
     
+    def _activity_flush_loop(self):
+        """后台线程：按固定间隔刷新活动时间缓冲区"""
+        while True:
+            time.sleep(AUTH_CONFIG['activity_flush_interval'])
+            self.flush_activity()
+
+    def flush_activity(self):
+        """将缓冲的最后活动时间在单个事务中批量写入数据库"""
+        with self._activity_lock:
+            if not self._activity_buffer:
+                return
+            pending, self._activity_buffer = self._activity_buffer, {}
+        try:
+            with self.write_conn() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.executemany(_SQL_UPDATE_ACTIVITY,
+                                 [(ts, token) for token, ts in pending.items()])
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error("批量更新活动时间失败: %s", e)
+
+    def _maintenance_loop(self):
+        """后台线程：定期清理过期数据"""
+        while True:
+            time.sleep(AUTH_CONFIG['maintenance_interval'])
+            self.prune_expired()
+
+    def prune_expired(self):
+        """删除超出保留期的登录记录与已过期的IP锁定，并截断WAL文件"""
+        now = int(time.time())
+        try:
+            with self.write_conn() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                attempts = conn.execute(_SQL_PRUNE_ATTEMPTS,
+                                        (now - AUTH_CONFIG['login_log_retention'],)).rowcount
+                conn.execute(_SQL_PRUNE_LOCKOUTS, (now,))
+                conn.commit()
+                conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            if attempts:
+                logger.info("已清理过期登录记录 %s 条", attempts)
+        except sqlite3.Error as e:
+            logger.error("清理过期数据失败: %s", e)
+
     def is_ip_locked(self, ip_address: str) -> Tuple[bool, Optional[datetime]]:
-        """检查IP是否被锁定"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT locked_until FROM ip_lockouts 
-            WHERE ip_address = ? AND locked_until > CURRENT_TIMESTAMP
-        ''', (ip_address,))
-        
-        result = cursor.fetchone()
-        conn.close()
-        
-        if result:
-            locked_until = datetime.fromisoformat(result[0])
-            return True, locked_until
-        
-        return False, None
+        """检查IP是否被锁定（优先查内存镜像，未命中时以数据库为准）"""
+        with self._lockout_lock:
+            locked_until = self._lockouts.get(ip_address)
+            if locked_until is not None and locked_until <= time.time():
+                # 顺带清理已过期的锁定
+                del self._lockouts[ip_address]
+                return False, None
+        if locked_until is None:
+            # 多进程部署时锁定可能由其他进程写入，内存未命中需回查数据库
+            try:
+                with self.read_conn() as conn:
+                    row = conn.execute(_SQL_GET_LOCKOUT, (ip_address, int(time.time()))).fetchone()
+            except sqlite3.Error as e:
+                logger.error("查询IP锁定状态失败: %s", e)
+                return False, None
+            if row is None:
+                return False, None
+            locked_until = row[0]
+            with self._lockout_lock:
+                self._lockouts[ip_address] = locked_until
+        return True, datetime.fromtimestamp(locked_until)
     
     def record_login_attempt(self, ip_address: str, username: str, 
                            success: bool, user_agent: str = None):
         """记录登录尝试"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        now = int(time.time())
+        locked_until = None
         try:
-            # 记录登录尝试
-            cursor.execute('''
-                INSERT INTO login_attempts 
-                (ip_address, username, success, user_agent)
-                VALUES (?, ?, ?, ?)
-            ''', (ip_address, username, success, user_agent))
-            
-            # 如果登录失败，检查是否需要锁定IP
-            if not success:
-                # 获取最近的失败尝试次数
-                cursor.execute('''
-                    SELECT COUNT(*) FROM login_attempts 
-                    WHERE ip_address = ? AND success = FALSE 
-                    AND timestamp > datetime('now', '-1 hour')
-                ''', (ip_address,))
+            with self.write_conn() as conn:
+                cursor = conn.cursor()
+                cursor.execute('BEGIN IMMEDIATE')
                 
-                fail_count = cursor.fetchone()[0]
+                # 记录登录尝试
+                cursor.execute(_SQL_INSERT_ATTEMPT,
+                               (ip_address, username, success, now, user_agent))
                 
-                if fail_count >= AUTH_CONFIG['max_login_attempts']:
-                    # 锁定IP
-                    locked_until = datetime.now() + timedelta(
-                        seconds=AUTH_CONFIG['lockout_duration']
-                    )
+                # 如果登录失败，检查是否需要锁定IP
+                if not success:
+                    # 获取最近一小时的失败尝试次数
+                    cursor.execute(_SQL_COUNT_FAILURES, (ip_address, now - 3600))
                     
-                    cursor.execute('''
-                        INSERT OR REPLACE INTO ip_lockouts 
-                        (ip_address, locked_until, attempts_count)
-                        VALUES (?, ?, ?)
-                    ''', (ip_address, locked_until, fail_count))
+                    fail_count = cursor.fetchone()[0]
                     
-                    logger.warning(f"IP地址被锁定: {ip_address}, 失败次数: {fail_count}")
+                    if fail_count >= _MAX_LOGIN_ATTEMPTS:
+                        # 锁定IP
+                        locked_until = now + _LOCKOUT_DURATION
+                        
+                        cursor.execute(_SQL_UPSERT_LOCKOUT,
+                                       (ip_address, locked_until, fail_count))
+                        
+                        logger.warning("IP地址被锁定: %s, 失败次数: %s", ip_address, fail_count)
+                
+                conn.commit()
             
-            conn.commit()
+            if locked_until is not None:
+                with self._lockout_lock:
+                    self._lockouts[ip_address] = locked_until
             
         except sqlite3.Error as e:
-            logger.error(f"记录登录尝试失败: {e}")
-        finally:
-            conn.close()
+            logger.error("记录登录尝试失败: %s", e)
     
     def validate_credentials(self, username: str, password: str) -> bool:
-        """验证用户凭据"""
-        valid_creds = AUTH_CONFIG['valid_credentials']
-        return username in valid_creds and valid_creds[username] == password
+        """验证用户凭据（常量时间比较密码）"""
+        expected = _CREDS.get(username)
+        return expected is not None and hmac.compare_digest(expected, password.encode('utf-8'))
     
     def create_device_session(self, ip_address: str, session_token: str, user_agent: str = None):
         """创建设备会话"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # 计算过期时间
-            expires_at = datetime.now() + timedelta(seconds=AUTH_CONFIG['session_duration'])
-            
-            # 更新或插入设备信息
-            cursor.execute("""
-                INSERT OR REPLACE INTO devices 
-                (ip_address, user_agent, first_seen, last_seen, is_authenticated, auth_expires)
-                VALUES (?, ?, 
-                    COALESCE((SELECT first_seen FROM devices WHERE ip_address = ?), ?),
-                    ?, 1, ?)
-            """, (ip_address, user_agent, ip_address, 
-                  datetime.now().isoformat(), datetime.now().isoformat(), expires_at.isoformat()))
-            
-            # 停用该IP的旧会话（确保后续查询只返回有效一条）
-            cursor.execute("""
-                UPDATE device_sessions 
-                SET is_active = 0 
-                WHERE ip_address = ?
-            """, (ip_address,))
-            
-            # 创建新会话
-            cursor.execute("""
-                INSERT INTO device_sessions 
-                (ip_address, session_token, expires_at, last_activity)
-                VALUES (?, ?, ?, ?)
-            """, (ip_address, session_token, expires_at.isoformat(), datetime.now().isoformat()))
-            
-            conn.commit()
-            conn.close()
+            with self.write_conn() as conn:
+                cursor = conn.cursor()
+                cursor.execute('BEGIN IMMEDIATE')
+                
+                # 计算过期时间
+                now = int(time.time())
+                expires_at = now + _SESSION_DURATION
+                
+                # 停用该IP的旧会话（确保后续查询只返回有效一条）
+                # 须先于设备UPSERT执行，否则触发器会重置刚写入的认证状态
+                cursor.execute(_SQL_DEACTIVATE_SESSIONS, (ip_address,))
+                
+                # 更新或插入设备信息（UPSERT，冲突时保留原 first_seen）
+                cursor.execute(_SQL_UPSERT_DEVICE, (ip_address, user_agent, now, now, expires_at))
+                
+                # 创建新会话
+                cursor.execute(_SQL_INSERT_SESSION, (ip_address, session_token, expires_at, now))
+                
+                conn.commit()
             
-            logger.info(f"设备会话已创建: IP={ip_address}, 过期时间={expires_at}")
+            logger.info("设备会话已创建: IP=%s, 过期时间=%s", ip_address, datetime.fromtimestamp(expires_at))
             
         except Exception as e:
-            logger.error(f"创建设备会话失败: {e}")
+            logger.error("创建设备会话失败: %s", e)
     
     def deactivate_device_session(self, ip_address: str):
         """停用设备会话"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # 将对应IP的会话设置为不活跃
-            cursor.execute("""
-                UPDATE device_sessions 
-                SET is_active = 0 
-                WHERE ip_address = ?
-            """, (ip_address,))
-            
-            # 同时更新devices表的状态
-            cursor.execute("""
-                UPDATE devices 
-                SET is_authenticated = 0, auth_expires = NULL 
-                WHERE ip_address = ?
-            """, (ip_address,))
-            
-            conn.commit()
-            conn.close()
-            logger.info(f"设备会话已停用: IP={ip_address}")
+            with self.write_conn() as conn:
+                # 将对应IP的会话设置为不活跃（devices表由触发器同步）
+                conn.execute(_SQL_DEACTIVATE_SESSIONS, (ip_address,))
+            logger.info("设备会话已停用: IP=%s", ip_address)
             
         except Exception as e:
-            logger.error(f"停用设备会话失败: {e}")
+            logger.error("停用设备会话失败: %s", e)
 
     def verify_device_session(self, session_token: str, ip_address: str) -> bool:
         """验证设备会话"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.read_conn() as conn:
+                cursor = conn.cursor()
 
-            cursor.execute("""
-                SELECT expires_at FROM device_sessions
-                WHERE session_token = ?
-                  AND ip_address = ?
-                  AND is_active = 1
-                  AND expires_at > ?
-            """, (session_token, ip_address, datetime.now().isoformat()))
+                cursor.execute(_SQL_VERIFY_SESSION, (session_token, ip_address, int(time.time())))
 
-            result = cursor.fetchone()
+                result = cursor.fetchone()
 
             if result:
-                # 更新最后活动时间
-                cursor.execute("""
-                    UPDATE device_sessions
-                    SET last_activity = ?
-                    WHERE session_token = ?
-                """, (datetime.now().isoformat(), session_token))
-                conn.commit()
-                conn.close()
-                logger.info(f"会话验证成功: IP={ip_address}")
+                # 记录最后活动时间，由后台线程批量落库
+                with self._activity_lock:
+                    self._activity_buffer[session_token] = int(time.time())
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("会话验证成功: IP=%s", ip_address)
                 return True
 
-            conn.close()
-            logger.warning(f"会话验证失败: IP={ip_address}, Token={session_token}")
+            logger.warning("会话验证失败: IP=%s, Token=%s", ip_address, session_token)
             return False
 
         except Exception as e:
-            logger.error(f"验证设备会话异常: {e}")
+            logger.error("验证设备会话异常: %s", e)
             return False
-            
-    def get_client_ip(self, request_obj) -> str:
-        """获取客户端真实IP地址"""
-        # 检查代理头
-        if request_obj.headers.get('X-Forwarded-For'):
-            return request_obj.headers.get('X-Forwarded-For').split(',')[0].strip()
-        elif request_obj.headers.get('X-Real-IP'):
-            return request_obj.headers.get('X-Real-IP')
-        else:
-            return request_obj.remote_addr
 
-# 创建认证管理器实例
-auth_manager = AuthManager()
+def get_client_ip(request_obj) -> str:
+    """获取客户端真实IP地址"""
+    # 检查代理头（每个头只读取一次）
+    headers = request_obj.headers
+    xff = headers.get('X-Forwarded-For')
+    if xff:
+        return xff.split(',', 1)[0].strip()
+    return headers.get('X-Real-IP') or request_obj.remote_addr
+
+# 创建认证管理器实例（可通过 WIFI_AUTH_DB 指定数据库路径，例如放在 /dev/shm）
+auth_manager = AuthManager(os.environ.get('WIFI_AUTH_DB', 'wifi_auth.db'))
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """健康检查接口"""
-    return jsonify({
+    return ojsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
         'service': 'WiFi认证API服务'
@@ -337,10 +575,10 @@ def login():
     """用户登录接口"""
     try:
         # 解析请求数据（JSON 或 表单）
-        data = request.get_json(silent=True) or {}
+        data = parse_json() or {}
         username = (data.get('username') or request.form.get('username') or '').strip()
         password = (data.get('password') or request.form.get('password') or '')
-        client_ip = auth_manager.get_client_ip(request)
+        client_ip = get_client_ip(request)
         user_agent = request.headers.get('User-Agent', '')
         
         # 验证必填字段
@@ -354,7 +592,7 @@ def login():
                 </body></html>
                 """
                 return Response(html, status=400, mimetype='text/html; charset=utf-8')
-            return jsonify({
+            return ojsonify({
                 'success': False,
                 'error': '用户名和密码不能为空'
             }), 400
@@ -363,7 +601,7 @@ def login():
         is_locked, locked_until = auth_manager.is_ip_locked(client_ip)
         if is_locked:
             remaining_time = int((locked_until - datetime.now()).total_seconds())
-            return jsonify({
+            return ojsonify({
                 'success': False,
                 'error': f'IP地址已被锁定，请在 {remaining_time} 秒后重试',
                 'locked_until': locked_until.isoformat(),
@@ -378,13 +616,12 @@ def login():
         
         if is_valid:
             # 生成会话令牌
-            session_data = f"{client_ip}:{username}:{datetime.now().timestamp()}"
-            session_token = hashlib.sha256(session_data.encode()).hexdigest()
+            session_token = secrets.token_urlsafe(32)
             
             # 创建设备会话
             auth_manager.create_device_session(client_ip, session_token, user_agent)
             
-            logger.info(f"用户登录成功: IP={client_ip}, 用户={username}")
+            logger.info("用户登录成功: IP=%s, 用户=%s", client_ip, username)
             
             # 如浏览器希望HTML，返回美化后的纯HTML成功页（兼容门户迷你浏览器）
             if 'text/html' in (request.headers.get('Accept') or '').lower():
@@ -435,18 +672,18 @@ def login():
                 </html>
                 """
                 return Response(html, mimetype='text/html; charset=utf-8')
-            return jsonify({
+            return ojsonify({
                 'success': True,
                 'message': '认证成功',
                 'data': {
                     'session_token': session_token,
-                    'expires_in': AUTH_CONFIG['session_duration'],
+                    'expires_in': _SESSION_DURATION,
                     'username': username,
                     'client_ip': client_ip
                 }
             })
         else:
-            logger.warning(f"用户登录失败: IP={client_ip}, 用户={username}")
+            logger.warning("用户登录失败: IP=%s, 用户=%s", client_ip, username)
             if 'text/html' in (request.headers.get('Accept') or '').lower():
                 html = """
                 <html><body>
@@ -455,16 +692,16 @@ def login():
                 </body></html>
                 """
                 return Response(html, status=401, mimetype='text/html; charset=utf-8')
-            return jsonify({
+            return ojsonify({
                 'success': False,
                 'error': '用户名或密码错误'
             }), 401
     
     except Exception as e:
-        logger.error(f"登录接口异常: {e}")
+        logger.error("登录接口异常: %s", e)
         if 'text/html' in (request.headers.get('Accept') or '').lower():
             return Response("<html><body><p>服务器内部错误</p></body></html>", status=500, mimetype='text/html; charset=utf-8')
-        return jsonify({
+        return ojsonify({
             'success': False,
             'error': '服务器内部错误'
         }), 500
@@ -472,7 +709,7 @@ def login():
 @app.route('/api/auth/fallback', methods=['GET'])
 def fallback_login_form():
     """提供简易的纯HTML登录表单，兼容旧版/受限浏览器。"""
-    client_ip = auth_manager.get_client_ip(request)
+    client_ip = get_client_ip(request)
     redirect_url = request.args.get('redirect') or 'http://neverssl.com'
     html = f"""
     <!doctype html>
@@ -532,12 +769,12 @@ def fallback_login_form():
 def verify_session():
     """验证会话接口"""
     try:
-        data = request.get_json()
+        data = parse_json()
         session_token = data.get('session_token') if data else None
-        client_ip = auth_manager.get_client_ip(request)
+        client_ip = get_client_ip(request)
         
         if not session_token:
-            return jsonify({
+            return ojsonify({
                 'success': False,
                 'error': '会话令牌不能为空'
             }), 400
@@ -546,7 +783,7 @@ def verify_session():
         is_valid_session = auth_manager.verify_device_session(session_token, client_ip)
         
         if is_valid_session:
-            return jsonify({
+            return ojsonify({
                 'success': True,
                 'message': '会话有效',
                 'data': {
@@ -555,14 +792,14 @@ def verify_session():
                 }
             })
         else:
-            return jsonify({
+            return ojsonify({
                 'success': False,
                 'error': '会话无效或已过期'
             }), 401
     
     except Exception as e:
-        logger.error(f"会话验证异常: {e}")
-        return jsonify({
+        logger.error("会话验证异常: %s", e)
+        return ojsonify({
             'success': False,
             'error': '服务器内部错误'
         }), 500
@@ -571,27 +808,27 @@ def verify_session():
 def logout():
     """用户登出接口"""
     try:
-        data = request.get_json()
-        client_ip = data.get('client_ip') if data else auth_manager.get_client_ip(request)
+        data = parse_json()
+        client_ip = data.get('client_ip') if data else get_client_ip(request)
         
         if not client_ip:
-            return jsonify({'success': False, 'error': '无法确定客户端IP'}), 400
+            return ojsonify({'success': False, 'error': '无法确定客户端IP'}), 400
         
-        logger.info(f"[{client_ip}] 收到登出请求")
+        logger.info("[%s] 收到登出请求", client_ip)
         
         # 停用设备会话
         auth_manager.deactivate_device_session(client_ip)
         
 
             
-        return jsonify({
+        return ojsonify({
             'success': True,
             'message': '登出成功'
         })
     
     except Exception as e:
-        logger.error(f"登出接口异常: {e}")
-        return jsonify({
+        logger.error("登出接口异常: %s", e)
+        return ojsonify({
             'success': False,
             'error': '服务器内部错误'
         }), 500
@@ -600,22 +837,20 @@ def logout():
 def get_devices():
     """获取设备列表（管理接口）"""
     try:
-        conn = sqlite3.connect(auth_manager.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT ip_address, user_agent, first_seen, last_seen, 
-                   is_authenticated, auth_expires
-            FROM devices 
-            ORDER BY last_seen DESC
-            LIMIT 100
-        ''')
+        with auth_manager.read_conn() as conn:
+            rows = conn.execute(_SQL_LIST_DEVICES).fetchall()
         
-        devices = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        # 直接按列位置构造字典，省去 sqlite3.Row 代理
+        devices = [{
+            'ip_address': r[0],
+            'user_agent': r[1],
+            'first_seen': r[2],
+            'last_seen': r[3],
+            'is_authenticated': r[4],
+            'auth_expires': r[5]
+        } for r in rows]
         
-        return jsonify({
+        return ojsonify({
             'success': True,
             'data': {
                 'devices': devices,
@@ -624,8 +859,8 @@ def get_devices():
         })
     
     except Exception as e:
-        logger.error(f"获取设备列表异常: {e}")
-        return jsonify({
+        logger.error("获取设备列表异常: %s", e)
+        return ojsonify({
             'success': False,
             'error': '服务器内部错误'
         }), 500
@@ -637,21 +872,18 @@ def get_auth_logs():
         limit = request.args.get('limit', 50, type=int)
         offset = request.args.get('offset', 0, type=int)
         
-        conn = sqlite3.connect(auth_manager.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT ip_address, username, success, timestamp, user_agent
-            FROM login_attempts 
-            ORDER BY timestamp DESC
-            LIMIT ? OFFSET ?
-        ''', (limit, offset))
+        with auth_manager.read_conn() as conn:
+            rows = conn.execute(_SQL_LIST_LOGS, (limit, offset)).fetchall()
         
-        logs = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        logs = [{
+            'ip_address': r[0],
+            'username': r[1],
+            'success': r[2],
+            'timestamp': r[3],
+            'user_agent': r[4]
+        } for r in rows]
         
-        return jsonify({
+        return ojsonify({
             'success': True,
             'data': {
                 'logs': logs,
@@ -661,8 +893,8 @@ def get_auth_logs():
         })
     
     except Exception as e:
-        logger.error(f"获取认证日志异常: {e}")
-        return jsonify({
+        logger.error("获取认证日志异常: %s", e)
+        return ojsonify({
             'success': False,
             'error': '服务器内部错误'
         }), 500
@@ -670,7 +902,7 @@ def get_auth_logs():
 @app.errorhandler(404)
 def not_found(error):
     """404错误处理"""
-    return jsonify({
+    return ojsonify({
         'success': False,
         'error': '接口不存在'
     }), 404
@@ -678,21 +910,29 @@ def not_found(error):
 @app.errorhandler(500)
 def internal_error(error):
     """500错误处理"""
-    return jsonify({
+    return ojsonify({
         'success': False,
         'error': '服务器内部错误'
     }), 500
 
+def serve(host: str = '0.0.0.0', port: int = 8080, threads: int = 16):
+    """以生产WSGI服务器运行API（优先waitress，未安装时回退到Flask内置服务器）"""
+    try:
+        from waitress import serve as waitress_serve
+    except ImportError:
+        logger.warning("未安装waitress，使用Flask内置服务器运行")
+        app.run(host=host, port=port, debug=False, threaded=True)
+        return
+    waitress_serve(app, host=host, port=port, threads=threads)
+
 if __name__ == '__main__':
     # 启动API服务器
     port = int(os.environ.get('PORT', 8080))
     debug = os.environ.get('DEBUG', 'False').lower() == 'true'
     
-    logger.info(f"WiFi认证API服务启动: 端口={port}, 调试模式={debug}")
+    logger.info("WiFi认证API服务启动: 端口=%s, 调试模式=%s", port, debug)
     
-    app.run(
-        host='0.0.0.0',
-        port=port,
-        debug=debug,
-        threaded=True
-    )
\ No newline at end of file
+    if debug:
+        app.run(host='0.0.0.0', port=port, debug=True, threaded=True)
+    else:
+        serve(port=port)
@@ -5,17 +5,22 @@ WiFi二次认证代理服务器
 实现流量拦截、认证检查和页面跳转功能
 """
 
+import http.client
 import http.server
 import socketserver
-import select
+import selectors
 import urllib.parse
 import sqlite3
 import logging
 import argparse
+import re
+import atexit
 import sys
 import os
+import signal
 import socket
-from datetime import datetime, timedelta
+import struct
+import time
 from pathlib import Path
 
 # 设置日志
@@ -49,42 +54,557 @@ def setup_logging():
 
 setup_logging()
 logger = logging.getLogger(__name__)
-AUTH_SERVER_IP = None  # 缓存本机局域网IP，避免频繁扫描网卡
+AUTH_SERVER_IP = None  # 缓存本机局域网IP，避免频繁扫描网卡；服务启动前由 refresh_local_ip() 填充
+_WHITELIST_HOSTS = frozenset()  # 白名单域名 + 本机IP，随 AUTH_SERVER_IP 一起重建
+_FALLBACK_AUTH_URL = ''  # 认证页地址前缀（仅差 client_ip 参数），随 AUTH_SERVER_IP 一起重建
+_SPA_AUTH_URL = ''
 FORCE_FALLBACK_AUTH = True  # 强制所有未认证跳到纯HTML认证表单，避免白屏
 
 import queue
 import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 
-# 全局数据库连接池
+# 热点SQL语句（固定文本，命中连接的预编译语句缓存）
+_SQL_CHECK_AUTH = """
+    SELECT expires_at FROM device_sessions
+    WHERE ip_address = ? AND is_active = 1 AND expires_at > ?
+"""
+_SQL_ACTIVE_SESSIONS = """
+    SELECT ip_address, MAX(expires_at) FROM device_sessions
+    WHERE is_active = 1 AND expires_at > ?
+    GROUP BY ip_address
+"""
+_SQL_UPDATE_ACTIVITY = """
+    UPDATE device_sessions SET last_activity = ?
+    WHERE ip_address = ? AND is_active = 1
+"""
+# devices 表的认证状态由数据库触发器同步重置
+# 只停用已过期的会话：延迟落库期间用户重新登录产生的新会话不受影响
+_SQL_DEACTIVATE_EXPIRED = """
+    UPDATE device_sessions SET is_active = 0
+    WHERE ip_address = ? AND is_active = 1 AND expires_at <= ?
+"""
+
+# 全局数据库连接池：1 个写连接（互斥使用）+ N-1 个只读连接
+# WAL 模式下读不阻塞写，认证检查可并行走只读连接，不必排队等待写锁
 class DatabaseConnectionPool:
+    COMMON_PRAGMAS = (
+        'PRAGMA busy_timeout=5000;',
+        'PRAGMA temp_store=MEMORY;',
+        'PRAGMA cache_size=-20000;',
+        'PRAGMA mmap_size=268435456;',
+    )
+    WRITER_PRAGMAS = COMMON_PRAGMAS + (
+        'PRAGMA journal_mode=WAL;',
+        'PRAGMA synchronous=NORMAL;',  # WAL 下提交只刷 WAL，不做二次 fsync
+        'PRAGMA wal_autocheckpoint=1000;',
+    )
+    READER_PRAGMAS = COMMON_PRAGMAS + (
+        'PRAGMA query_only=1;',
+        'PRAGMA read_uncommitted=0;',
+    )
+
     def __init__(self, db_path, max_connections=10):
         self.db_path = db_path
         self.max_connections = max_connections
-        self._pool = queue.Queue(maxsize=max_connections)
-        self._lock = threading.Lock()
+        self._readers = queue.Queue(maxsize=max(1, max_connections - 1))
+        self._writer_lock = threading.Lock()
+        self._writer = None
+        # 只读连接以 mode=ro 打开（写连接先建立，数据库文件此时已存在）
+        self._ro_uri = Path(os.path.abspath(db_path)).as_uri() + '?mode=ro'
         
         # 初始化连接池
-        for _ in range(max_connections):
-            try:
-                conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
-                conn.execute('PRAGMA journal_mode=WAL;')
-                self._pool.put(conn)
-            except Exception as e:
-                logger.error(f"创建数据库连接失败: {e}")
+        try:
+            self._writer = self._make_conn(self.WRITER_PRAGMAS)
+            for _ in range(self._readers.maxsize):
+                self._readers.put(self._make_conn(self.READER_PRAGMAS, read_only=True))
+        except Exception as e:
+            logger.error(f"创建数据库连接失败: {e}")
 
-    def get_conn(self):
-        """从池中获取一个连接"""
-        return self._pool.get()
+    def _make_conn(self, pragmas, read_only=False):
+        # isolation_level=None：单条写语句即时提交，不持有隐式事务
+        target = self._ro_uri if read_only else self.db_path
+        conn = sqlite3.connect(target, uri=read_only, timeout=10, check_same_thread=False,
+                               isolation_level=None, cached_statements=64)
+        conn.executescript(''.join(pragmas))
+        return conn
 
-    def return_conn(self, conn):
-        """将连接返回到池中"""
-        self._pool.put(conn)
+    @contextmanager
+    def reader(self):
+        """借用一个只读连接"""
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    @contextmanager
+    def writer(self):
+        """独占写连接；异常时回滚未提交的事务，避免连接停留在事务中一直持有写锁"""
+        with self._writer_lock:
+            try:
+                yield self._writer
+            except Exception:
+                self._writer.rollback()
+                raise
 
 # 创建全局连接池实例
-db_pool = DatabaseConnectionPool(str(Path(__file__).parent.parent.parent / "wifi_auth.db"))
+db_pool = DatabaseConnectionPool(os.environ.get('WIFI_AUTH_DB')
+                                 or str(Path(__file__).parent.parent.parent / "wifi_auth.db"))
+
+# 认证结果缓存：ip -> (会话过期时间, 最近一次查库时间, 最近一次写入活动时间)，均为 epoch 秒
+# 登出发生在API进程，缓存只在 AUTH_CACHE_TTL 内免查库，过期后重新确认会话是否仍有效
+# 未认证结果以过期时间 0 缓存，时长很短，以免登录成功后仍被拦截
+AUTH_CACHE_TTL = 5
+AUTH_NEGATIVE_CACHE_TTL = 1
+ACTIVITY_WRITE_INTERVAL = 30  # last_activity 写库的最小间隔（秒）
+AUTH_CACHE_MAX_ENTRIES = 4096  # 按最近使用淘汰，限制长期运行时的内存占用
+_AUTH_CACHE = OrderedDict()
+_AUTH_CACHE_LOCK = threading.Lock()
+
+def _cache_auth(client_ip: str, entry):
+    """写入认证缓存并淘汰最久未使用的条目"""
+    with _AUTH_CACHE_LOCK:
+        _AUTH_CACHE[client_ip] = entry
+        _AUTH_CACHE.move_to_end(client_ip)
+        while len(_AUTH_CACHE) > AUTH_CACHE_MAX_ENTRIES:
+            _AUTH_CACHE.popitem(last=False)
+
+def invalidate_auth(client_ip: str):
+    """移除指定IP的认证缓存"""
+    with _AUTH_CACHE_LOCK:
+        _AUTH_CACHE.pop(client_ip, None)
+
+# 已认证IP快照：ip -> 会话过期时间（epoch 秒），后台线程每 AUTH_SNAPSHOT_INTERVAL 秒整表刷新
+# 认证缓存未命中时查快照而不是查库；快照过旧（刷新线程出错）时退回逐IP查询
+AUTH_SNAPSHOT_INTERVAL = 1
+AUTH_SNAPSHOT_MAX_AGE = AUTH_SNAPSHOT_INTERVAL * 3
+_AUTH_SNAPSHOT = None
+_AUTH_SNAPSHOT_AT = 0.0  # 最近一次成功刷新的 monotonic 时间
+
+def refresh_auth_snapshot():
+    """一次查询载入全部有效会话，替换已认证IP快照"""
+    global _AUTH_SNAPSHOT, _AUTH_SNAPSHOT_AT
+    try:
+        with db_pool.reader() as conn:
+            rows = conn.execute(_SQL_ACTIVE_SESSIONS, (int(time.time()),)).fetchall()
+    except Exception as e:
+        logger.error(f"刷新已认证IP快照失败: {e}")
+        return
+    _AUTH_SNAPSHOT = dict(rows)
+    _AUTH_SNAPSHOT_AT = time.monotonic()
+
+def _auth_snapshot_loop():
+    """后台线程：按固定间隔刷新已认证IP快照"""
+    while True:
+        refresh_auth_snapshot()
+        time.sleep(AUTH_SNAPSHOT_INTERVAL)
+
+threading.Thread(target=_auth_snapshot_loop, name='auth-snapshot', daemon=True).start()
+
+# 写缓冲区：处理线程只登记，由后台线程定期在单个事务中批量写入，处理线程不再争用写连接
+#   _ACTIVITY_BUFFER: ip -> 最后活动时间（epoch秒）
+#   _DEACTIVATE_BUFFER: ip -> 判定过期的时间（epoch秒）
+ACTIVITY_FLUSH_INTERVAL = 5
+_ACTIVITY_BUFFER = {}
+_DEACTIVATE_BUFFER = {}
+_ACTIVITY_LOCK = threading.Lock()
+
+def flush_activity():
+    """将缓冲的最后活动时间与过期会话停用批量写入数据库"""
+    global _ACTIVITY_BUFFER, _DEACTIVATE_BUFFER
+    with _ACTIVITY_LOCK:
+        if not _ACTIVITY_BUFFER and not _DEACTIVATE_BUFFER:
+            return
+        activity, _ACTIVITY_BUFFER = _ACTIVITY_BUFFER, {}
+        expired, _DEACTIVATE_BUFFER = _DEACTIVATE_BUFFER, {}
+    try:
+        with db_pool.writer() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if activity:
+                conn.executemany(_SQL_UPDATE_ACTIVITY, [(ts, ip) for ip, ts in activity.items()])
+            if expired:
+                conn.executemany(_SQL_DEACTIVATE_EXPIRED, list(expired.items()))
+            conn.commit()
+        for ip in expired:
+            logger.info(f"[{ip}] 会话已停用")
+    except Exception as e:
+        logger.error(f"批量写入活动时间/会话状态失败: {e}")
+
+def _activity_flush_loop():
+    """后台线程：按固定间隔刷新活动时间缓冲区"""
+    while True:
+        time.sleep(ACTIVITY_FLUSH_INTERVAL)
+        flush_activity()
+
+threading.Thread(target=_activity_flush_loop, name='activity-flush', daemon=True).start()
+atexit.register(flush_activity)
+
+# HTTPS 隧道事件循环：握手完成后隧道移交给少量 selector 线程统一转发，
+# 处理线程随即释放，空闲的长连接只占用 fd 与少量缓冲，而不再各占一个线程
+TUNNEL_BUFFER_SIZE = 65536
+TUNNEL_IDLE_TIMEOUT = 300  # 隧道双向均无数据的最长保留时间（秒）
+TUNNEL_SWEEP_INTERVAL = 30  # 空闲隧道清理间隔（秒）
+TUNNELS_PER_LOOP = 200     # 单个事件循环承载的隧道数（Windows select 上限为 512 个 fd）
+TUNNEL_READS_PER_EVENT = 16  # 单次就绪事件内最多连续读取的次数
+# Linux 下隧道数据经管道在内核内 splice 转发，不再复制到用户态
+_SPLICE_FLAGS = (os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK) if hasattr(os, 'splice') else 0
+
+TCP_KEEPALIVE_IDLE = 60      # 空闲多久开始发送保活探测（秒）
+TCP_KEEPALIVE_INTERVAL = 10  # 探测间隔（秒）
+TCP_KEEPALIVE_COUNT = 5      # 连续失败多少次判定断开
+# 收发缓冲区：Linux 内核会自动调整且可远超该值，显式设置反而关闭自动调整，因此只在其他平台设置
+SOCKET_BUFFER_SIZE = 262144
+_SET_SOCKET_BUFFERS = not sys.platform.startswith('linux')
+
+def tune_socket(sock):
+    """代理连接统一设置：关闭 Nagle，开启 TCP 保活以及时发现半开连接"""
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if _SET_SOCKET_BUFFERS:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, TCP_KEEPALIVE_IDLE)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, TCP_KEEPALIVE_INTERVAL)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, TCP_KEEPALIVE_COUNT)
+    elif hasattr(socket, 'SIO_KEEPALIVE_VALS'):
+        sock.ioctl(socket.SIO_KEEPALIVE_VALS,
+                   (1, TCP_KEEPALIVE_IDLE * 1000, TCP_KEEPALIVE_INTERVAL * 1000))
+
+class _Tunnel:
+    """一条隧道的两端及写往各端的待发送数据"""
+    __slots__ = ('client', 'upstream', 'pending', 'pipes', 'closing', 'last_active')
+
+    def __init__(self, client, upstream):
+        self.client = client
+        self.upstream = upstream
+        # pipes：写往各端的内核管道 (r, w)；此时 pending 记录管道中待发送的字节数
+        self.pipes = None
+        if _SPLICE_FLAGS:
+            try:
+                self.pipes = {client: os.pipe(), upstream: os.pipe()}
+            except OSError:
+                self.pipes = None  # fd 不足时退回用户态转发
+        if self.pipes:
+            self.pending = {client: 0, upstream: 0}
+        else:
+            self.pending = {client: bytearray(), upstream: bytearray()}
+        self.closing = False
+        self.last_active = time.monotonic()
+
+    def peer(self, sock):
+        return self.upstream if sock is self.client else self.client
+
+class TunnelRelay:
+    """单线程 selector 事件循环，负责若干条隧道的双向转发"""
+
+    def __init__(self):
+        self.load = 0  # 已分配的隧道数，由 _relays_lock 保护
+        self._selector = selectors.DefaultSelector()
+        self._incoming = queue.SimpleQueue()
+        self._tunnels = set()
+        # 用于唤醒 select 的本地 socket 对
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+        threading.Thread(target=self._run, name='tunnel-relay', daemon=True).start()
+
+    def add(self, client, upstream, initial=b''):
+        """移交一条已建立的隧道；initial 为客户端已发送但尚未转发的数据"""
+        self._incoming.put((client, upstream, initial))
+        try:
+            self._wake_w.send(b'\0')
+        except OSError:
+            pass
+
+    def _run(self):
+        view = memoryview(bytearray(TUNNEL_BUFFER_SIZE))
+        last_sweep = time.monotonic()
+        while True:
+            # 无隧道时无限期阻塞，直到有新隧道移交；否则只在空闲清理到期时醒来
+            timeout = None
+            if self._tunnels:
+                timeout = max(0.0, last_sweep + TUNNEL_SWEEP_INTERVAL - time.monotonic())
+            for key, mask in self._selector.select(timeout=timeout):
+                tunnel = key.data
+                if tunnel is None:
+                    self._accept_new()
+                    continue
+                if tunnel not in self._tunnels:
+                    continue  # 本轮已被关闭
+                sock = key.fileobj
+                try:
+                    if mask & selectors.EVENT_WRITE:
+                        self._flush(tunnel, sock)
+                    if mask & selectors.EVENT_READ:
+                        self._read(tunnel, sock, view)
+                except OSError:
+                    self._close(tunnel)
+                    continue
+                tunnel.last_active = time.monotonic()
+                if tunnel.closing and not tunnel.pending[tunnel.client] and not tunnel.pending[tunnel.upstream]:
+                    self._close(tunnel)
+                else:
+                    self._update(tunnel, tunnel.client)
+                    self._update(tunnel, tunnel.upstream)
+
+            now = time.monotonic()
+            if now - last_sweep >= TUNNEL_SWEEP_INTERVAL:
+                last_sweep = now
+                for tunnel in [t for t in self._tunnels if now - t.last_active > TUNNEL_IDLE_TIMEOUT]:
+                    self._close(tunnel)
+
+    def _accept_new(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except OSError:
+            pass
+        while True:
+            try:
+                client, upstream, initial = self._incoming.get_nowait()
+            except queue.Empty:
+                return
+            tunnel = _Tunnel(client, upstream)
+            try:
+                client.setblocking(False)
+                upstream.setblocking(False)
+            except OSError:
+                self._tunnels.add(tunnel)
+                self._close(tunnel)
+                continue
+            if initial:
+                if tunnel.pipes:
+                    tunnel.pending[upstream] += os.write(tunnel.pipes[upstream][1], initial)
+                else:
+                    tunnel.pending[upstream] += initial
+            self._tunnels.add(tunnel)
+            self._update(tunnel, client)
+            self._update(tunnel, upstream)
+
+    def _read(self, tunnel, sock, view):
+        # 一次就绪事件内连续收发，直到读空或对端出现积压，减少每字节的 select 次数
+        peer = tunnel.peer(sock)
+        if tunnel.pipes:
+            self._splice_read(tunnel, sock, peer)
+            return
+        for _ in range(TUNNEL_READS_PER_EVENT):
+            try:
+                n = sock.recv_into(view)
+            except BlockingIOError:
+                return
+            if not n:
+                # 对端关闭：停止读取，待剩余数据发送完毕后关闭隧道
+                tunnel.closing = True
+                return
+            try:
+                sent = peer.send(view[:n])
+            except BlockingIOError:
+                sent = 0
+            if sent < n:
+                tunnel.pending[peer] += view[sent:n]
+                return
+            if n < len(view):
+                return
+
+    def _flush(self, tunnel, sock):
+        if tunnel.pipes:
+            self._splice_flush(tunnel, sock)
+            return
+        buf = tunnel.pending[sock]
+        try:
+            sent = sock.send(buf)
+        except BlockingIOError:
+            return
+        del buf[:sent]
+
+    def _splice_read(self, tunnel, sock, peer):
+        """socket -> 管道 -> 对端 socket，全程在内核内完成"""
+        pipe_w = tunnel.pipes[peer][1]
+        for _ in range(TUNNEL_READS_PER_EVENT):
+            try:
+                n = os.splice(sock.fileno(), pipe_w, TUNNEL_BUFFER_SIZE, flags=_SPLICE_FLAGS)
+            except BlockingIOError:
+                return
+            if not n:
+                tunnel.closing = True
+                return
+            tunnel.pending[peer] += n
+            self._splice_flush(tunnel, peer)
+            if tunnel.pending[peer]:
+                return
+
+    def _splice_flush(self, tunnel, sock):
+        pipe_r = tunnel.pipes[sock][0]
+        while tunnel.pending[sock]:
+            try:
+                n = os.splice(pipe_r, sock.fileno(), tunnel.pending[sock], flags=_SPLICE_FLAGS)
+            except BlockingIOError:
+                return
+            if not n:
+                return
+            tunnel.pending[sock] -= n
+
+    def _update(self, tunnel, sock):
+        """按缓冲状态调整监听事件：对端有积压时暂停读取（背压）"""
+        events = 0
+        if not tunnel.closing and not tunnel.pending[tunnel.peer(sock)]:
+            events |= selectors.EVENT_READ
+        if tunnel.pending[sock]:
+            events |= selectors.EVENT_WRITE
+        try:
+            key = self._selector.get_key(sock)
+        except KeyError:
+            if events:
+                self._selector.register(sock, events, tunnel)
+            return
+        if not events:
+            self._selector.unregister(sock)
+        elif key.events != events:
+            self._selector.modify(sock, events, tunnel)
+
+    def _close(self, tunnel):
+        self._tunnels.discard(tunnel)
+        for sock in (tunnel.client, tunnel.upstream):
+            try:
+                self._selector.unregister(sock)
+            except (KeyError, ValueError):
+                pass
+            try:
+                sock.close()
+            except OSError:
+                pass
+        for fd in (fd for pipe in (tunnel.pipes or {}).values() for fd in pipe):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        with _relays_lock:
+            self.load -= 1
+
+_relays = []
+_relays_lock = threading.Lock()
+
+def hand_off_tunnel(client, upstream, initial=b''):
+    """把隧道交给负载未满的事件循环，必要时新建一个"""
+    with _relays_lock:
+        relay = next((r for r in _relays if r.load < TUNNELS_PER_LOOP), None)
+        if relay is None:
+            relay = TunnelRelay()
+            _relays.append(relay)
+        relay.load += 1
+    relay.add(client, upstream, initial)
+
+# 上游 HTTP 长连接池：(host, port) -> deque[(HTTPConnection, 空闲起始时间)]
+UPSTREAM_IDLE_TIMEOUT = 30   # 空闲连接保留时间（秒）
+UPSTREAM_MAX_IDLE_PER_HOST = 8
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+# 逐跳头：不在客户端与上游之间透传
+HOP_BY_HOP_HEADERS = frozenset(('connection', 'keep-alive', 'proxy-connection', 'transfer-encoding'))
+_UPSTREAM_POOL = {}
+_UPSTREAM_POOL_LOCK = threading.Lock()
+
+class UpstreamConnection(http.client.HTTPConnection):
+    """上游连接：请求头以预先拼好的整块写入，不再逐个 putheader 格式化与校验"""
+
+    def putheader_block(self, block: bytes):
+        """追加若干以 CRLF 分隔的头部行（末尾不带 CRLF），须在 putrequest 之后调用"""
+        self._buffer.append(block)
+
+def get_upstream(host: str, port: int):
+    """取出一个空闲的上游连接，没有则返回 None"""
+    now = time.monotonic()
+    with _UPSTREAM_POOL_LOCK:
+        idle = _UPSTREAM_POOL.get((host, port))
+        while idle:
+            conn, since = idle.pop()
+            if now - since < UPSTREAM_IDLE_TIMEOUT:
+                return conn
+            conn.close()
+    return None
+
+def release_upstream(host: str, port: int, conn):
+    """归还可复用的上游连接"""
+    with _UPSTREAM_POOL_LOCK:
+        idle = _UPSTREAM_POOL.setdefault((host, port), deque())
+        if len(idle) < UPSTREAM_MAX_IDLE_PER_HOST:
+            idle.append((conn, time.monotonic()))
+            return
+    conn.close()
+
+def _upstream_reaper():
+    """后台线程：关闭超时的空闲上游连接"""
+    while True:
+        time.sleep(UPSTREAM_IDLE_TIMEOUT)
+        now = time.monotonic()
+        with _UPSTREAM_POOL_LOCK:
+            for key, idle in list(_UPSTREAM_POOL.items()):
+                while idle and now - idle[0][1] >= UPSTREAM_IDLE_TIMEOUT:
+                    idle.popleft()[0].close()
+                if not idle:
+                    del _UPSTREAM_POOL[key]
+
+threading.Thread(target=_upstream_reaper, name='upstream-reaper', daemon=True).start()
+
+# DNS 解析缓存：新建上游连接时跳过重复的 getaddrinfo；
+# 临近过期仍被访问的条目由后台线程提前刷新，常用域名不会在请求路径上等待解析
+DNS_CACHE_TTL = 60
+DNS_REFRESH_AHEAD = 10  # 剩余有效期低于该值（秒）时后台预取
+DNS_CACHE_MAX_ENTRIES = 1024
+_DNS_CACHE = OrderedDict()  # (host, port) -> (ip, 过期时间)
+_DNS_REFRESHING = set()
+_DNS_CACHE_LOCK = threading.Lock()
+
+def _lookup_host(host: str, port: int):
+    """执行 getaddrinfo 并写入缓存，失败返回 None"""
+    try:
+        ip = socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_STREAM)[0][4][0]
+    except (OSError, UnicodeError):
+        return None
+    key = (host, port)
+    with _DNS_CACHE_LOCK:
+        _DNS_CACHE[key] = (ip, time.monotonic() + DNS_CACHE_TTL)
+        _DNS_CACHE.move_to_end(key)
+        while len(_DNS_CACHE) > DNS_CACHE_MAX_ENTRIES:
+            _DNS_CACHE.popitem(last=False)
+    return ip
+
+def _refresh_host(host: str, port: int):
+    try:
+        _lookup_host(host, port)
+    finally:
+        with _DNS_CACHE_LOCK:
+            _DNS_REFRESHING.discard((host, port))
+
+def resolve_host(host: str, port: int) -> str:
+    """解析目标主机的 IPv4 地址并缓存；解析失败时原样返回，由连接阶段报告错误"""
+    key = (host, port)
+    now = time.monotonic()
+    with _DNS_CACHE_LOCK:
+        cached = _DNS_CACHE.get(key)
+        if cached and cached[1] > now:
+            _DNS_CACHE.move_to_end(key)
+            refresh = cached[1] - now < DNS_REFRESH_AHEAD and key not in _DNS_REFRESHING
+            if refresh:
+                _DNS_REFRESHING.add(key)
+        else:
+            cached = None
+    if cached:
+        if refresh:
+            threading.Thread(target=_refresh_host, args=key, name='dns-prefetch', daemon=True).start()
+        return cached[0]
+    return _lookup_host(host, port) or host
 
 class WiFiAuthProxy(http.server.BaseHTTPRequestHandler):
     """WiFi认证代理处理器"""
+
+    # 客户端连接空闲超时（秒），避免只连不发的连接长期占用工作线程
+    timeout = 60
+    # 代理以小块转发为主，关闭 Nagle 避免响应头与首个数据块之间的延迟确认等待
+    disable_nagle_algorithm = True
     
     # 数据库路径 (现在由连接池管理)
     # db_path = 'wifi_auth.db'
@@ -101,7 +621,16 @@ class WiFiAuthProxy(http.server.BaseHTTPRequestHandler):
     WHITELIST_PORTS = {5173, 8080}  # 前端端口和API端口
     
     # 认证相关的路径
-    AUTH_PATHS = {'/api/auth', '/api/health', '/api/admin'}
+    AUTH_PATHS = ('/api/auth', '/api/health', '/api/admin')  # str.startswith 需要元组
+    # 未认证时强制 302 的常见入口根域名
+    FORCE_PROBE_ROOTS = (
+        'apple.com', 'icloud.com', 'baidu.com', 'qq.com', 'wechat.com', 'weixin.qq.com',
+        'google.com', 'gstatic.com', 'youtube.com', 'bilibili.com', 'taobao.com', 'tmall.com'
+    )
+    # 以上匹配规则在类加载时编译为正则，每个请求只需一次 C 层匹配
+    _FORCE_PROBE_RE = re.compile(r'(?:^|\.)(?:%s)$' % '|'.join(map(re.escape, FORCE_PROBE_ROOTS)))
+    _PROBE_HOST_RE = re.compile(r'captive\.apple\.com|connectivitycheck|clients3\.google\.com')
+    _PROBE_PATH_RE = re.compile(r'hotspot-detect|generate_204')
     IOS_PROBE_HOSTS = {
         'captive.apple.com',
         'www.apple.com',
@@ -167,6 +696,29 @@ class WiFiAuthProxy(http.server.BaseHTTPRequestHandler):
                 logger.warning(f"[{client_ip}] 拦截到未认证的 {self.command} 请求: {host}{self.path}")
                 self.send_error(403, "Forbidden")
             
+    def parse_request(self):
+        # 未认证的 CONNECT 在解析请求头之前直接拒绝：只凭请求行即可判断
+        if self.raw_requestline.startswith(b'CONNECT ') and self._reject_connect_early():
+            return False
+        return super().parse_request()
+
+    def _reject_connect_early(self) -> bool:
+        """请求行为 CONNECT 且目标不在白名单、客户端未认证时，写出预生成的 503 并返回 True"""
+        words = self.raw_requestline.split(None, 2)
+        if len(words) < 2:
+            return False  # 畸形请求行交由标准解析报错
+        target = words[1].decode('latin-1')
+        client_ip = self.client_address[0]
+        if self._is_whitelisted(target) or self._is_authenticated(client_ip):
+            return False
+        logger.info(f"[{client_ip}] 未认证的HTTPS请求，拒绝连接: {target}")
+        self.close_connection = True
+        try:
+            self.wfile.write(_CONNECT_REJECT_RESPONSE)
+        except OSError:
+            pass
+        return True
+
     def do_CONNECT(self):
         """
         处理HTTPS连接请求。
@@ -193,84 +745,76 @@ class WiFiAuthProxy(http.server.BaseHTTPRequestHandler):
             return False
         
         # 分离主机名和端口
-        hostname = host.split(':')[0].lower()
+        hostname = host.partition(':')[0].lower()
         
-        # 检查是否是认证服务器的IP或localhost（使用缓存）
-        auth_server_ip = get_auth_server_ip()
-        if hostname in ('localhost', '127.0.0.1', '::1', auth_server_ip):
-            return True
-            
-        # 检查是否是白名单中的其他域名
-        if hostname in self.WHITELIST_DOMAINS:
-            return True
-            
-        return False
+        # 认证服务器IP与白名单域名合并为一个集合，一次查找即可（集合在服务启动前建立）
+        return hostname in _WHITELIST_HOSTS
     
     def _is_auth_request(self, path):
         """检查是否是认证相关请求"""
         # 使用更精确的匹配来避免误判
-        return path.startswith(('/api/auth', '/api/health', '/api/admin'))
+        return path.startswith(self.AUTH_PATHS)
     
     def _is_authenticated(self, client_ip: str) -> bool:
         """
         检查设备是否已认证。
         """
-        conn = None
+        now = time.time()
+        with _AUTH_CACHE_LOCK:
+            cached = _AUTH_CACHE.get(client_ip)
+            if cached:
+                _AUTH_CACHE.move_to_end(client_ip)
+        if cached:
+            if not cached[0]:
+                if now - cached[1] < AUTH_NEGATIVE_CACHE_TTL:
+                    return False
+            elif now < cached[0] and now - cached[1] < AUTH_CACHE_TTL:
+                # 命中缓存：不访问数据库，仅按间隔刷新活动时间
+                if now - cached[2] >= ACTIVITY_WRITE_INTERVAL:
+                    self._update_activity(client_ip)
+                    _cache_auth(client_ip, (cached[0], cached[1], now))
+                return True
+
         try:
-            conn = db_pool.get_conn()
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT expires_at
-                FROM device_sessions 
-                WHERE ip_address = ? AND is_active = 1 AND expires_at > ?
-            """, (client_ip, datetime.now().isoformat()))
-            result = cursor.fetchone()
-
-            if not result:
-                return False
+            snapshot = _AUTH_SNAPSHOT
+            if snapshot is not None and time.monotonic() - _AUTH_SNAPSHOT_AT < AUTH_SNAPSHOT_MAX_AGE:
+                expires_at = snapshot.get(client_ip)
+            else:
+                with db_pool.reader() as conn:
+                    # expires_at 为 Unix 秒，直接做整数比较
+                    result = conn.execute(_SQL_CHECK_AUTH, (client_ip, int(now))).fetchone()
+                expires_at = result[0] if result else None
 
-            expires_at_str = result[0]
-            expires_time = datetime.fromisoformat(expires_at_str)
+            if not expires_at:
+                _cache_auth(client_ip, (0, now, 0))
+                return False
 
-            # 再次校验并更新活跃时间
-            if datetime.now() > expires_time:
-                self._deactivate_session(client_ip, conn)
+            # 再次校验并更新活跃时间（快照中的会话可能已在两次刷新之间过期）
+            if time.time() > expires_at:
+                self._deactivate_session(client_ip)
                 return False
             
-            self._update_activity(client_ip, conn)
+            activity_at = cached[2] if cached else 0
+            if now - activity_at >= ACTIVITY_WRITE_INTERVAL:
+                self._update_activity(client_ip)
+                activity_at = now
+            _cache_auth(client_ip, (expires_at, now, activity_at))
             return True
 
         except Exception as e:
             logger.error(f"检查认证状态失败: {e}")
             return False
-        finally:
-            if conn:
-                db_pool.return_conn(conn)
 
-    def _update_activity(self, client_ip: str, conn):
-        """更新设备的最后活动时间"""
-        try:
-            cursor = conn.cursor()
-            cursor.execute("""
-                UPDATE device_sessions 
-                SET last_activity = ? 
-                WHERE ip_address = ? AND is_active = 1
-            """, (datetime.now().isoformat(), client_ip))
-            conn.commit()
-        except Exception as e:
-            logger.error(f"更新活动时间失败: {e}")
+    def _update_activity(self, client_ip: str):
+        """记录设备的最后活动时间（写入缓冲区，由后台线程批量落库）"""
+        with _ACTIVITY_LOCK:
+            _ACTIVITY_BUFFER[client_ip] = int(time.time())
 
-    def _deactivate_session(self, client_ip: str, conn):
-        """使用传入的数据库连接停用会话"""
-        try:
-            cursor = conn.cursor()
-            cursor.execute("UPDATE device_sessions SET is_active = 0 WHERE ip_address = ?", (client_ip,))
-            cursor.execute("UPDATE devices SET is_authenticated = 0 WHERE ip_address = ?", (client_ip,))
-            conn.commit()
-            logger.info(f"[{client_ip}] 会话已停用")
-        except Exception as e:
-            logger.error(f"停用会话失败: {e}")
+    def _deactivate_session(self, client_ip: str):
+        """停用该IP已过期的会话（写入缓冲区，由后台线程批量落库）"""
+        with _ACTIVITY_LOCK:
+            _DEACTIVATE_BUFFER[client_ip] = int(time.time())
+        invalidate_auth(client_ip)
     
 
     
@@ -278,7 +822,6 @@ class WiFiAuthProxy(http.server.BaseHTTPRequestHandler):
         """重定向/指引到认证页面。默认 302；也可使用 511 以配合OS的门户识别。
         对受限/老旧门户浏览器，自动切换到纯HTML表单以避免白屏。
         """
-        local_ip = get_auth_server_ip()
         client_ip = self.client_address[0]
         user_agent = (self.headers.get('User-Agent') or '').lower()
         accept_hdr = (self.headers.get('Accept') or '').lower()
@@ -297,30 +840,14 @@ class WiFiAuthProxy(http.server.BaseHTTPRequestHandler):
             ('text/html' in accept_hdr)
         )
 
-        if limited_portal:
-            # 使用后端提供的纯HTML登录表单，避免JS白屏
-            auth_url = f"http://{local_ip}:8080/api/auth/fallback?client_ip={client_ip}"
-        else:
-            # 默认跳转到前端SPA
-            auth_url = f"http://{local_ip}:5173?client_ip={client_ip}"
-        
-        self.send_response(status_code)
-        self.send_header('Location', auth_url)
-        self.send_header('Cache-Control', 'no-cache')
-        # 一些系统会读取自定义登录头部
-        self.send_header('X-Login-URL', auth_url)
-        self.send_header('Content-Type', 'text/html; charset=utf-8')
-        self.end_headers()
+        # 使用后端提供的纯HTML登录表单避免JS白屏，否则默认跳转到前端SPA
+        auth_url = (_FALLBACK_AUTH_URL if limited_portal else _SPA_AUTH_URL) + client_ip
+
+        # 状态行、响应头与正文按预生成模板一次写出，只需代入认证地址
+        template, fixed_len = _REDIRECT_TEMPLATES[status_code]
+        self.close_connection = True
         try:
-            # 提供简单HTML，便于系统/浏览器显示
-            body = f"""
-            <html><head><title>Network Authentication Required</title></head>
-            <body>
-            <p>该网络需要认证才能访问互联网。</p>
-            <p><a href='{auth_url}'>点此完成认证</a></p>
-            </body></html>
-            """.strip().encode('utf-8')
-            self.wfile.write(body)
+            self.wfile.write(template.format(url=auth_url, length=fixed_len + len(auth_url)).encode('utf-8'))
         except Exception:
             pass
 
@@ -328,15 +855,8 @@ class WiFiAuthProxy(http.server.BaseHTTPRequestHandler):
         """识别常见的网络连通性探测请求（iOS/Android）。"""
         if not host:
             return False
-        h = host.lower()
-        p = path.lower()
-        # iOS 常见探测
-        if 'captive.apple.com' in h or 'hotspot-detect' in p:
-            return True
-        # Android 常见探测
-        if 'connectivitycheck' in h or 'generate_204' in p or 'clients3.google.com' in h:
-            return True
-        return False
+        # iOS: captive.apple.com / hotspot-detect；Android: connectivitycheck / generate_204
+        return bool(self._PROBE_HOST_RE.search(host.lower()) or self._PROBE_PATH_RE.search(path.lower()))
 
     def _should_force_probe(self, host: str) -> bool:
         """当访问常见根域名（用户常输入）时，未认证强制 302 触发。
@@ -344,21 +864,18 @@ class WiFiAuthProxy(http.server.BaseHTTPRequestHandler):
         """
         if not host:
             return False
-        h = host.lower().split(':')[0]
-        # 常见入口域名：apple/google/baidu/qq/wechat 等
-        force_roots = (
-            'apple.com', 'icloud.com', 'baidu.com', 'qq.com', 'wechat.com', 'weixin.qq.com',
-            'google.com', 'gstatic.com', 'youtube.com', 'bilibili.com', 'taobao.com', 'tmall.com'
-        )
-        return any(h.endswith(root) for root in force_roots)
+        # 常见入口域名：apple/google/baidu/qq/wechat 等，只匹配根域本身及其子域
+        return self._FORCE_PROBE_RE.search(host.partition(':')[0].lower()) is not None
     
     def _proxy_request(self):
         """
-        使用底层Socket转发HTTP请求，保证对前端/API的放行，同时避免长连接导致的阻塞。
-        - 移除 Proxy-Connection 头
-        - 强制 Connection: close，避免后端保持长连接导致挂起
-        - 保证 Host 头正确
+        转发HTTP请求，保证对前端/API的放行。
+        - 移除 Proxy-Connection 等逐跳头，保证 Host 头正确
+        - 上游复用长连接（连接池），响应按 HTTP 报文边界读取
+        - 对客户端仍为短连接：响应发送完毕即关闭
         """
+        conn = None
+        started = False
         try:
             # 解析目标主机和端口
             host_header = self.headers.get('Host', '')
@@ -376,12 +893,7 @@ class WiFiAuthProxy(http.server.BaseHTTPRequestHandler):
                 except ValueError:
                     target_port = 80
 
-            # 建立到目标服务器的连接
-            target_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            target_socket.settimeout(10)
-            target_socket.connect((target_host, target_port))
-
-            # 构造请求行，确保使用 origin-form（避免把绝对URL转发给源站导致404/白屏）
+            # 构造请求目标，确保使用 origin-form（避免把绝对URL转发给源站导致404/白屏）
             raw_target = self.path
             request_target = raw_target
             try:
@@ -394,77 +906,98 @@ class WiFiAuthProxy(http.server.BaseHTTPRequestHandler):
             except Exception:
                 request_target = raw_target or '/'
 
-            request_line = f"{self.command} {request_target} {self.protocol_version}\r\n"
-
-            # 构造并清洗请求头
-            cleaned_headers = []
+            # 构造并清洗请求头：一次遍历拼成整块，头部值来自按 latin-1 解码的原始报文
             host_value = target_host if target_port in (80, 443) else f"{target_host}:{target_port}"
-            seen_host = False
+            client_ip = self.client_address[0]
+            scheme = 'https' if target_port == 443 else 'http'
+            header_lines = [f"Host: {host_value}"]
             for key, value in self.headers.items():
                 lk = key.lower()
-                if lk == 'proxy-connection':
-                    continue  # 代理特有头，移除
-                if lk == 'connection':
-                    continue  # 我们稍后强制为 close
-                if lk == 'host':
-                    seen_host = True
-                    cleaned_headers.append(f"Host: {host_value}\r\n")
-                    continue
-                cleaned_headers.append(f"{key}: {value}\r\n")
-
-            if not seen_host:
-                cleaned_headers.append(f"Host: {host_value}\r\n")
+                if lk in ('proxy-connection', 'connection', 'keep-alive', 'host'):
+                    continue  # 逐跳头移除（上游连接由连接池维持），Host 已按目标重写
+                header_lines.append(f"{key}: {value}")
             # 追加真实源IP与协议，便于后端获取客户端IP
-            client_ip = self.client_address[0]
-            cleaned_headers.append(f"X-Forwarded-For: {client_ip}\r\n")
-            cleaned_headers.append(f"X-Real-IP: {client_ip}\r\n")
-            scheme = 'https' if target_port == 443 else 'http'
-            cleaned_headers.append(f"X-Forwarded-Proto: {scheme}\r\n")
-            # 强制短连接，避免卡死
-            cleaned_headers.append("Connection: close\r\n")
-
-            headers_bytes = "".join(cleaned_headers).encode('utf-8') + b"\r\n"
+            header_lines.append(f"X-Forwarded-For: {client_ip}\r\nX-Real-IP: {client_ip}\r\nX-Forwarded-Proto: {scheme}")
+            header_block = "\r\n".join(header_lines).encode('latin-1', 'replace')
 
-            # 发送请求行和头
-            target_socket.sendall(request_line.encode('utf-8'))
-            target_socket.sendall(headers_bytes)
-
-            # 转发生体 (适用于POST等)
+            # 读取请求体 (适用于POST等)
             content_length = int(self.headers.get('Content-Length', 0))
-            if content_length > 0:
-                body = self.rfile.read(content_length)
-                if body:
-                    target_socket.sendall(body)
+            body = self.rfile.read(content_length) if content_length > 0 else None
 
-            # 读取目标服务器响应并写回客户端
-            self.connection.settimeout(10)
+            # 幂等请求优先复用空闲连接，复用连接失效时换新连接重试一次
+            if self.command in IDEMPOTENT_METHODS:
+                conn = get_upstream(target_host, target_port)
             while True:
-                chunk = target_socket.recv(8192)
+                reused = conn is not None
+                if conn is None:
+                    conn = UpstreamConnection(resolve_host(target_host, target_port), target_port, timeout=10)
+                    conn.connect()
+                    tune_socket(conn.sock)
+                try:
+                    conn.putrequest(self.command, request_target, skip_host=True, skip_accept_encoding=True)
+                    conn.putheader_block(header_block)
+                    conn.endheaders(body)
+                    resp = conn.getresponse()
+                    break
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    conn.close()
+                    conn = None
+                    if not reused:
+                        raise
+
+            # 写回响应头：分块编码已由 http.client 解码，对客户端以关闭连接标记结束
+            lines = [f"HTTP/{'1.1' if resp.version == 11 else '1.0'} {resp.status} {resp.reason}\r\n"]
+            for key, value in resp.msg.items():
+                if key.lower() in HOP_BY_HOP_HEADERS:
+                    continue
+                lines.append(f"{key}: {value}\r\n")
+            lines.append("Connection: close\r\n\r\n")
+            # 响应头与首个数据块合并为一次写入，小响应只需一个报文
+            chunk = resp.read1(65536)
+            self.connection.settimeout(10)
+            self.wfile.write("".join(lines).encode('latin-1', 'replace') + chunk)
+            started = True
+            self.close_connection = True
+
+            # 读取目标服务器响应体并写回客户端
+            while chunk:
+                chunk = resp.read1(65536)
                 if not chunk:
                     break
                 try:
                     self.wfile.write(chunk)
                 except Exception:
-                    # 客户端断开
-                    break
+                    # 客户端断开，响应体未读完，上游连接不能复用，由 finally 关闭
+                    return
+
+            # 只有响应体读到 EOF（read1 返回空且声明长度已耗尽）且上游未要求关闭时才归还连接；
+            # isclosed() 在提前 close() 后同样为 True，不能据此判断已读完
+            if not resp.will_close and not resp.length:
+                resp.close()
+                release_upstream(target_host, target_port, conn)
+            else:
+                conn.close()
+            conn = None
 
         except Exception as e:
             logger.error(f"HTTP代理请求失败: {e}")
-            try:
-                self.send_error(502, "Proxy Error")
-            except Exception:
-                pass
+            if not started:
+                try:
+                    self.send_error(502, "Proxy Error")
+                except Exception:
+                    pass
         finally:
-            if 'target_socket' in locals():
+            if conn is not None:
                 try:
-                    target_socket.close()
+                    conn.close()
                 except Exception:
                     pass
 
     def _tunnel_https(self):
         """
-        使用底层Socket和select模型建立高效的HTTPS隧道。
+        建立HTTPS隧道：在处理线程中完成上游连接与握手响应，随后移交给隧道事件循环转发。
         """
+        handed_off = False
         try:
             host, port_str = self.path.split(':', 1)
             port = int(port_str)
@@ -472,16 +1005,25 @@ class WiFiAuthProxy(http.server.BaseHTTPRequestHandler):
             # 建立到目标服务器的连接
             target_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             target_socket.settimeout(10)
-            target_socket.connect((host, port))
+            target_socket.connect((resolve_host(host, port), port))
+            tune_socket(target_socket)
+            tune_socket(self.connection)
 
             # 向客户端发送连接成功响应
             self.send_response(200, 'Connection Established')
             self.end_headers()
 
-            # 开始双向转发数据
-            self.connection.settimeout(10)
-            target_socket.settimeout(10)
-            self._forward_socket_data(self.connection, target_socket)
+            # 取出客户端在握手响应前已发出、仍留在读缓冲中的数据
+            self.connection.setblocking(False)
+            initial = self.rfile.peek()
+            if initial:
+                self.rfile.read(len(initial))
+
+            # 移交隧道：本请求结束时服务器不再关闭该连接
+            self.close_connection = True
+            self.server.detach_request(self.connection)
+            hand_off_tunnel(self.connection, target_socket, initial)
+            handed_off = True
 
         except Exception as e:
             if "timed out" not in str(e).lower(): # 忽略超时日志
@@ -491,51 +1033,142 @@ class WiFiAuthProxy(http.server.BaseHTTPRequestHandler):
             except:
                 pass
         finally:
-            if 'target_socket' in locals():
+            if 'target_socket' in locals() and not handed_off:
                 target_socket.close()
-                
-    def _forward_socket_data(self, src, dst):
-        """
-        使用select模型在两个socket之间高效、双向地转发数据。
-        """
-        sockets = [src, dst]
-        while True:
-            readable, _, exceptional = select.select(sockets, [], sockets, 5)
-            
-            if exceptional:
-                break # 出现异常，中断连接
-            
-            if not readable:
-                continue # 没有可读数据，继续等待
-            
-            for sock in readable:
-                try:
-                    data = sock.recv(8192)
-                    if not data: # 对端关闭连接
-                        return
-                    
-                    if sock is src:
-                        dst.sendall(data)
-                    else:
-                        src.sendall(data)
-                except Exception:
-                    return # 发生错误，中断转发
+
+# 认证跳转响应模板：status -> (完整报文模板, 正文除认证地址外的字节数)
+# 提供简单HTML，便于系统/浏览器显示；X-Login-URL 供读取自定义登录头部的系统使用
+_REDIRECT_BODY = """
+            <html><head><title>Network Authentication Required</title></head>
+            <body>
+            <p>该网络需要认证才能访问互联网。</p>
+            <p><a href='{url}'>点此完成认证</a></p>
+            </body></html>
+            """.strip()
+_REDIRECT_TEMPLATES = {
+    code: (
+        f"{WiFiAuthProxy.protocol_version} {code} {WiFiAuthProxy.responses[code][0]}\r\n"
+        "Location: {url}\r\n"
+        "Cache-Control: no-cache\r\n"
+        "X-Login-URL: {url}\r\n"
+        "Content-Type: text/html; charset=utf-8\r\n"
+        "Content-Length: {length}\r\n"
+        "Connection: close\r\n\r\n" + _REDIRECT_BODY,
+        len(_REDIRECT_BODY.replace('{url}', '').encode('utf-8')),
+    )
+    for code in (302, 511)
+}
+
+# 未认证 CONNECT 的拒绝响应，在解析请求头之前一次写出
+_CONNECT_REJECT_RESPONSE = (
+    f"{WiFiAuthProxy.protocol_version} 503 Service Unavailable\r\n"
+    "Content-Length: 0\r\n"
+    "Connection: close\r\n\r\n"
+).encode('latin-1')
 
 class ThreadedHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
-    """多线程HTTP服务器"""
+    """多线程HTTP服务器（固定数量的工作线程 + 有界请求队列）"""
     daemon_threads = True
     allow_reuse_address = True
+    max_workers = min(64, (os.cpu_count() or 4) * 8)
+
+    def __init__(self, *args, reuse_port=False, **kwargs):
+        self._detached = set()
+        self._detached_lock = threading.Lock()
+        self.reuse_port = reuse_port
+        self._requests = queue.Queue(maxsize=self.max_workers * 4)
+        super().__init__(*args, **kwargs)
+        for i in range(self.max_workers):
+            threading.Thread(target=self._worker, name=f'wifi-proxy-{i}', daemon=True).start()
+
+    def process_request(self, request, client_address):
+        # 队列满时阻塞 accept 循环，突发连接由内核 backlog 承接，而不是无限创建线程
+        self._requests.put((request, client_address))
+
+    def _worker(self):
+        while True:
+            request, client_address = self._requests.get()
+            self.process_request_thread(request, client_address)
+
+    def server_bind(self):
+        # 多进程模式：各进程绑定同一端口，由内核分配新连接
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def detach_request(self, request):
+        """标记连接已移交给隧道事件循环，请求处理结束时保持连接不关闭"""
+        with self._detached_lock:
+            self._detached.add(request)
+
+    def shutdown_request(self, request):
+        with self._detached_lock:
+            if request in self._detached:
+                self._detached.discard(request)
+                return
+        super().shutdown_request(request)
+
+def _run_worker(address):
+    """多进程模式下的子进程入口：以 SO_REUSEPORT 绑定同一地址并独立提供服务"""
+    try:
+        refresh_local_ip()
+        _install_refresh_signal()
+        server = ThreadedHTTPServer(address, WiFiAuthProxy, reuse_port=True)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
 
 def get_auth_server_ip() -> str:
-    """获取并缓存本机局域网IP，避免频繁调用psutil。"""
-    global AUTH_SERVER_IP
+    """获取并缓存本机局域网IP，避免频繁探测网卡。"""
     if AUTH_SERVER_IP:
         return AUTH_SERVER_IP
-    AUTH_SERVER_IP = get_local_ip()
-    return AUTH_SERVER_IP
+    return refresh_local_ip()
+
+def refresh_local_ip() -> str:
+    """重新探测本机IP并重建白名单集合（网卡变化时调用，Unix 下可发送 SIGHUP 触发）"""
+    global AUTH_SERVER_IP, _WHITELIST_HOSTS, _FALLBACK_AUTH_URL, _SPA_AUTH_URL
+    ip = get_local_ip()
+    _WHITELIST_HOSTS = frozenset(WiFiAuthProxy.WHITELIST_DOMAINS | {ip})
+    _FALLBACK_AUTH_URL = f"http://{ip}:8080/api/auth/fallback?client_ip="
+    _SPA_AUTH_URL = f"http://{ip}:5173?client_ip="
+    AUTH_SERVER_IP = ip
+    return ip
+
+def _install_refresh_signal():
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame: refresh_local_ip())
+
+# 与 简单启动.py 相同的 RFC1918 + CGNAT 网段表，按 (网络号, 掩码) 的 32 位整数比较
+PRIVATE_NETS = (
+    (0x0A000000, 0xFF000000),  # 10.0.0.0/8
+    (0xAC100000, 0xFFF00000),  # 172.16.0.0/12
+    (0xC0A80000, 0xFFFF0000),  # 192.168.0.0/16
+    (0x64400000, 0xFFC00000),  # 100.64.0.0/10 (CGNAT)
+)
+
+def _is_private_ipv4(ip: str) -> bool:
+    try:
+        n = struct.unpack('!I', socket.inet_pton(socket.AF_INET, ip))[0]
+    except (OSError, TypeError):
+        return False
+    return any((n & mask) == base for base, mask in PRIVATE_NETS)
+
+def _probe_route_ip():
+    """UDP connect 不发送数据，只让内核选出默认路由的源地址；失败返回 None"""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(('8.8.8.8', 80))
+            return s.getsockname()[0]
+    except OSError:
+        return None
 
 def get_local_ip():
     """获取本机在局域网中的IP地址，优先选择私有IP段"""
+    # 默认路由的源地址为私有网段时直接采用，无需导入 psutil 遍历网卡
+    route_ip = _probe_route_ip()
+    if route_ip and _is_private_ipv4(route_ip):
+        logger.info(f"通过socket探测找到局域网IP: {route_ip}")
+        return route_ip
     try:
         import psutil
         # 遍历所有网络接口
@@ -547,45 +1180,58 @@ def get_local_ip():
                     if addr.family == socket.AF_INET:
                         ip = addr.address
                         # 检查是否是常见的局域网IP地址
-                        if ip.startswith('192.168.') or ip.startswith('10.') or (ip.startswith('172.') and 16 <= int(ip.split('.')[1]) <= 31):
+                        if _is_private_ipv4(ip):
                             logger.info(f"通过psutil在接口 '{interface}' 找到局域网IP: {ip}")
                             return ip
-        
-        # 如果以上方法找不到，使用socket连接外部地址的方法作为备用
-        logger.warning("未能通过psutil找到合适的局域网IP，尝试使用socket方法")
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-            s.settimeout(0.1)
-            s.connect(('8.8.8.8', 80))
-            ip = s.getsockname()[0]
-            logger.info(f"通过socket连接找到IP: {ip}")
-            return ip
-            
     except Exception as e:
-        logger.error(f"获取IP地址时发生错误: {e}. 回退到默认IP。")
-        # 最终的备用方案
-        return "192.168.1.101" # 最后的备用IP
+        logger.warning(f"通过psutil查找局域网IP失败: {e}")
+
+    # 默认路由不在私有网段且网卡中也没有合适地址时，仍使用探测结果
+    if route_ip:
+        logger.info(f"通过socket连接找到IP: {route_ip}")
+        return route_ip
+    logger.error("获取IP地址失败，回退到默认IP。")
+    # 最终的备用方案
+    return "192.168.1.101" # 最后的备用IP
 
 def main():
     parser = argparse.ArgumentParser(description='WiFi认证代理服务器')
     parser.add_argument('--port', type=int, default=8888, help='代理服务器端口')
     parser.add_argument('--host', default='0.0.0.0', help='监听地址')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='服务进程数（需要 SO_REUSEPORT，仅 Linux/BSD 有效）')
     args = parser.parse_args()
     
-    # 获取本机IP地址
-    local_ip = get_local_ip()
+    # 获取本机IP地址（同时建立白名单缓存）
+    local_ip = refresh_local_ip()
+    _install_refresh_signal()
+
+    workers = args.workers
+    if workers > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+        logger.warning("当前平台不支持 SO_REUSEPORT，忽略 --workers，使用单进程运行")
+        workers = 1
+    reuse_port = workers > 1
     
     try:
         # 创建服务器，优先使用指定host
         try:
-            server = ThreadedHTTPServer((args.host, args.port), WiFiAuthProxy)
+            server = ThreadedHTTPServer((args.host, args.port), WiFiAuthProxy, reuse_port=reuse_port)
         except OSError as bind_err:
             # 在某些Windows环境下，绑定到 0.0.0.0 可能被策略阻止，尝试回退到具体局域网IP
             if str(args.host) in ("0.0.0.0", "::"):
                 logger.warning(f"绑定到 {args.host}:{args.port} 失败，尝试使用本机IP {local_ip}:{args.port}。错误: {bind_err}")
-                server = ThreadedHTTPServer((local_ip, args.port), WiFiAuthProxy)
+                server = ThreadedHTTPServer((local_ip, args.port), WiFiAuthProxy, reuse_port=reuse_port)
             else:
                 raise
 
+        # 其余进程以 spawn 方式启动：重新导入模块，各自建立连接池与后台线程，避免 fork 继承 SQLite 连接和锁
+        if workers > 1:
+            import multiprocessing
+            ctx = multiprocessing.get_context('spawn')
+            for _ in range(workers - 1):
+                ctx.Process(target=_run_worker, args=(server.server_address,), daemon=True).start()
+            logger.info(f"已启动 {workers} 个代理进程共享端口 {server.server_address[1]}")
+
         print("=" * 60)
         print("WiFi认证代理服务器启动成功")
         print("=" * 60)
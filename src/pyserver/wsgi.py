@@ -0,0 +1,11 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+WiFi认证API的WSGI入口
+供 gunicorn / waitress-serve 等WSGI服务器加载，例如：
+    gunicorn -w 4 -k gthread --threads 8 -b 0.0.0.0:8080 src.pyserver.wsgi:app
+"""
+
+from .auth_api import app
+
+application = app
@@ -5,22 +5,15 @@
 
 def build_tray(exit_event=None):
     # 动态加载可选依赖，避免静态检查的导入错误
-    import importlib
-    try:
-        pystray = importlib.import_module('pystray')
-    except ImportError:
-        pystray = None
-    try:
-        pil_image_mod = importlib.import_module('PIL.Image')
-    except ImportError:
-        pil_image_mod = None
+    pystray = _optional_import('pystray')
+    pil_image_mod = _optional_import('PIL.Image')
 
-    icon_path = Path(__file__).parent / 'src' / 'assets' / 'wifiVerify.ico'
+    icon_path = _ICON_PATH
 
     # 简化：仅提供打开主页面/日志与退出
     def on_open_logs(_icon, _item):
         try:
-            os.startfile(str(Path(__file__).parent / 'logs'))
+            os.startfile(_LOG_DIR_STR)
         except OSError:
             pass
 
@@ -30,8 +23,8 @@ def build_tray(exit_event=None):
         except ImportError:
             webbrowser = None
         try:
-            # 动态获取当前可用IP
-            url = f"http://{get_local_ip()}:8080/api/auth/fallback"
+            # 获取当前可用IP（结果超过 LOCAL_IP_TTL 秒才重新枚举网卡）
+            url = f"http://{current_local_ip()}:8080/api/auth/fallback"
             if webbrowser is not None:
                 webbrowser.open(url)
             else:
@@ -52,8 +45,8 @@ def build_tray(exit_event=None):
         # 构造图像（Pillow）
         image = None
         try:
-            if icon_path.exists():
-                image = pil_image_mod.open(str(icon_path))
+            # 图标缺失时 open 直接抛出 OSError，无需预先 stat
+            image = pil_image_mod.open(icon_path)
         except OSError:
             image = None
         if image is None:
@@ -147,8 +140,8 @@ def build_tray(exit_event=None):
                     0, 0, 0, 0,
                     0, 0, self.hInstance, None
                 )
-                if icon_path.exists():
-                    self.hicon = win32gui.LoadImage(0, str(icon_path), win32con.IMAGE_ICON, 16, 16, win32con.LR_LOADFROMFILE)
+                if os.path.isfile(icon_path):
+                    self.hicon = win32gui.LoadImage(0, icon_path, win32con.IMAGE_ICON, 16, 16, win32con.LR_LOADFROMFILE)
                 else:
                     self.hicon = win32gui.LoadIcon(0, win32con.IDI_APPLICATION)
                 nid = (
@@ -201,166 +194,112 @@ def build_tray(exit_event=None):
         return _Win32Tray()
     except Exception:
         return None
-        try:
-            menu = pystray.Menu(
-                pystray.MenuItem('打开认证页面', on_open_main),
-                pystray.MenuItem('打开日志目录', on_open_logs),
-                pystray.MenuItem('退出', on_exit)
-            )
-            tray = pystray.Icon('WiFiVerifyTray', image, 'WiFi认证系统', menu)
-            return tray
-        except Exception:
-            pass
-
-    # ---- Fallback: 使用 Win32 原生托盘（pywin32）----
-    try:
-        import win32api
-        import win32con
-        import win32gui
-        import win32gui_struct
-
-        class _Win32Tray:
-            def __init__(self):
-                self.hInstance = win32api.GetModuleHandle(None)
-                self.className = 'WiFiVerifyTrayWndClass'
-                message_map = {
-                    win32con.WM_COMMAND: self._on_command,
-                    win32con.WM_DESTROY: self._on_destroy,
-                    win32con.WM_USER+20: self._on_notify,
-                }
-                wndclass = win32gui.WNDCLASS()
-                wndclass.hInstance = self.hInstance
-                wndclass.lpszClassName = self.className
-                wndclass.lpfnWndProc = message_map
-                try:
-                    win32gui.RegisterClass(wndclass)
-                except win32gui.error:
-                    pass
-                self.hwnd = win32gui.CreateWindow(
-                    self.className,
-                    'WiFiVerify',
-                    0,
-                    0, 0, 0, 0,
-                    0, 0, self.hInstance, None
-                )
-                # 图标
-                if icon_path.exists():
-                    hicon = win32gui.LoadImage(0, str(icon_path), win32con.IMAGE_ICON, 16, 16, win32con.LR_LOADFROMFILE)
-                else:
-                    hicon = win32gui.LoadIcon(0, win32con.IDI_APPLICATION)
-                self.hicon = hicon
-                # 使用 PackNOTIFYICONDATA，确保兼容 Win10/11 托盘消息
-                nid = win32gui_struct.PackNOTIFYICONDATA(
-                    self.hwnd, 0, win32con.NIF_MESSAGE | win32con.NIF_ICON | win32con.NIF_TIP,
-                    win32con.WM_USER+20, self.hicon, 'WiFi认证系统'
-                )
-                try:
-                    win32gui.Shell_NotifyIcon(win32gui.NIM_ADD, nid)
-                    # 设置版本为 4，启用高级行为
-                    nid2 = win32gui_struct.PackNOTIFYICONDATA(self.hwnd, 0)
-                    nid2.uVersion = 4
-                    win32gui.Shell_NotifyIcon(0x00000004, nid2)  # NIM_SETVERSION = 4
-                except win32gui.error:
-                    pass
-                # 菜单
-                self.menu = win32gui.CreatePopupMenu()
-                win32gui.AppendMenu(self.menu, win32con.MF_STRING, 1023, '打开认证页面')
-                win32gui.AppendMenu(self.menu, win32con.MF_STRING, 1024, '打开日志目录')
-                win32gui.AppendMenu(self.menu, win32con.MF_STRING, 1025, '退出')
-                self._visible = True
-
-            def _on_destroy(self, hwnd, msg, wparam, lparam):
-                nid = (self.hwnd, 0)
-                try:
-                    win32gui.Shell_NotifyIcon(win32gui.NIM_DELETE, nid)
-                except win32gui.error:
-                    pass
-                win32gui.PostQuitMessage(0)
-                return True
-
-            def _on_command(self, hwnd, msg, wparam, lparam):
-                cmd = win32api.LOWORD(wparam)
-                if cmd == 1023:
-                    on_open_main()
-                elif cmd == 1024:
-                    on_open_logs(None, None)
-                elif cmd == 1025:
-                    try:
-                        if exit_event is not None:
-                            exit_event.set()
-                    except Exception:
-                        pass
-                    # 终止主循环，让 finally 块回收所有子进程
-                    try:
-                        win32gui.PostQuitMessage(0)
-                    except Exception:
-                        pass
-                return True
-
-            def _on_notify(self, hwnd, msg, wparam, lparam):
-                if lparam in (win32con.WM_RBUTTONUP, win32con.WM_CONTEXTMENU):
-                    pos = win32gui.GetCursorPos()
-                    win32gui.SetForegroundWindow(self.hwnd)
-                    cmd = win32gui.TrackPopupMenu(
-                        self.menu,
-                        win32con.TPM_LEFTALIGN | win32con.TPM_RETURNCMD | win32con.TPM_RIGHTBUTTON,
-                        pos[0], pos[1], 0, self.hwnd, None
-                    )
-                    if cmd:
-                        win32gui.PostMessage(self.hwnd, win32con.WM_COMMAND, cmd, 0)
-                elif lparam in (win32con.WM_LBUTTONDBLCLK, win32con.WM_LBUTTONUP):
-                    on_open_main()
-                return True
 
-            # pystray 接口兼容
-            def run(self):
-                win32gui.PumpMessages()
-
-            def stop(self):
-                try:
-                    win32gui.DestroyWindow(self.hwnd)
-                except win32gui.error:
-                    pass
-
-            def notify(self, text):
-                try:
-                    flags = win32gui.NIF_INFO
-                    nid = (self.hwnd, 0, flags, win32con.WM_USER+20, self.hicon, 'WiFi认证系统', text, 200, '提示')
-                    win32gui.Shell_NotifyIcon(win32gui.NIM_MODIFY, nid)
-                except win32gui.error:
-                    pass
-
-            @property
-            def visible(self):
-                return self._visible
-
-            @visible.setter
-            def visible(self, v):
-                self._visible = v
-
-        return _Win32Tray()
-    except Exception:
-        return None
- 
 
 import os
 import subprocess
 import sys
 import time
 import socket
+import struct
+import functools
+import importlib
+import importlib.util
+import re
 from pathlib import Path
 import ctypes
 import msvcrt
 from tempfile import gettempdir
 import platform
 import threading
+import select
 import argparse
+import atexit
 from typing import List, Tuple
 
+_IS_WINDOWS = platform.system() == "Windows"
 # Windows: creation flag to hide child process consoles
-CREATE_NO_WINDOW = 0x08000000 if platform.system() == "Windows" else 0
+CREATE_NO_WINDOW = 0x08000000 if _IS_WINDOWS else 0
 ERROR_ALREADY_EXISTS = 183
 CONTROL_UDP_PORT = 49621  # 本地UDP端口用于激活已运行实例
+PROJECT_ROOT = Path(__file__).resolve().parent
+LOG_DIR = PROJECT_ROOT / 'logs'
+_ICON_PATH = str(PROJECT_ROOT / 'src' / 'assets' / 'wifiVerify.ico')
+_PROJECT_ROOT_STR = str(PROJECT_ROOT)
+_LOG_DIR_STR = str(LOG_DIR)
+# 单实例锁所在的用户数据目录
+APP_DATA_DIR = Path(os.getenv('LOCALAPPDATA') or gettempdir()) / 'VerifyWifi'
+# 子进程入口：打包后为自身exe，开发环境为 python + 脚本路径
+_SELF_ARGV = (sys.executable,) if getattr(sys, 'frozen', False) else (sys.executable, str(Path(__file__).resolve()))
+_API_ARGV = _SELF_ARGV + ('--role', 'api')
+_PROXY_ARGV = _SELF_ARGV + ('--role', 'proxy', '--host', '0.0.0.0', '--port', '8888')
+# 防火墙已配置标记：存于 HKCU 注册表，启动时一次键值查询即可判断，无需创建数据目录或 stat 标记文件
+_FIREWALL_REG_KEY = r'Software\VerifyWifi'
+_FIREWALL_REG_VALUE = 'FirewallOk'
+
+# Win32 API 在模块加载时绑定一次并声明参数/返回类型，调用时不再经 windll 属性查找与参数类型推断
+if _IS_WINDOWS:
+    import winreg
+    from ctypes import wintypes
+    _kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    _shell32 = ctypes.WinDLL('shell32')
+    _user32 = ctypes.WinDLL('user32')
+
+    def _bind(dll, name, argtypes, restype):
+        func = getattr(dll, name)
+        func.argtypes = argtypes
+        func.restype = restype
+        return func
+
+    _HandlerRoutine = ctypes.WINFUNCTYPE(wintypes.BOOL, wintypes.DWORD)
+    _CreateMutexW = _bind(_kernel32, 'CreateMutexW', (wintypes.LPVOID, wintypes.BOOL, wintypes.LPCWSTR), wintypes.HANDLE)
+    _CloseHandle = _bind(_kernel32, 'CloseHandle', (wintypes.HANDLE,), wintypes.BOOL)
+    _GetConsoleWindow = _bind(_kernel32, 'GetConsoleWindow', (), wintypes.HWND)
+    _FreeConsole = _bind(_kernel32, 'FreeConsole', (), wintypes.BOOL)
+    _SetConsoleCtrlHandler = _bind(_kernel32, 'SetConsoleCtrlHandler', (_HandlerRoutine, wintypes.BOOL), wintypes.BOOL)
+    _IsUserAnAdmin = _bind(_shell32, 'IsUserAnAdmin', (), wintypes.BOOL)
+    _ShellExecuteW = _bind(_shell32, 'ShellExecuteW',
+                           (wintypes.HWND, wintypes.LPCWSTR, wintypes.LPCWSTR, wintypes.LPCWSTR, wintypes.LPCWSTR, ctypes.c_int),
+                           wintypes.HINSTANCE)
+    _MessageBoxW = _bind(_user32, 'MessageBoxW', (wintypes.HWND, wintypes.LPCWSTR, wintypes.LPCWSTR, wintypes.UINT), ctypes.c_int)
+    _ShowWindow = _bind(_user32, 'ShowWindow', (wintypes.HWND, ctypes.c_int), wintypes.BOOL)
+    _GetAdaptersAddresses = _bind(ctypes.WinDLL('iphlpapi'), 'GetAdaptersAddresses',
+                                  (wintypes.ULONG, wintypes.ULONG, wintypes.LPVOID, wintypes.LPVOID,
+                                   ctypes.POINTER(wintypes.ULONG)),
+                                  wintypes.ULONG)
+
+
+@functools.lru_cache(maxsize=None)
+def _optional_import(name: str):
+    """导入可选依赖（psutil/pystray/PIL），每个模块只尝试一次，缺失时返回 None。
+    缓存失败结果，避免每次调用都重新扫描 sys.path。"""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+@functools.lru_cache(maxsize=None)
+def _module_available(name: str) -> bool:
+    """只查找模块规格而不执行模块代码，用于探测可选依赖是否已安装。"""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+class _WakeupEvent(threading.Event):
+    """set() 时同时向本地 socket 对写入一个字节，唤醒在 select 中等待的主线程"""
+
+    def __init__(self):
+        super().__init__()
+        self.wake_r, self._wake_w = socket.socketpair()
+
+    def set(self):
+        super().set()
+        try:
+            self._wake_w.send(b'\0')
+        except OSError:
+            pass
+
 class _InstanceState:
     handle = None
     lock_file_handle = None
@@ -370,24 +309,25 @@ class _InstanceState:
 def ensure_single_instance(name: str = "VerifyWifiSingleInstance") -> bool:
     """Windows下使用本地会话互斥 + 文件锁双保险，确保单实例运行。"""
     # 1) Windows命名互斥（会话内），避免管理员/普通用户跨会话不可见问题
-    if platform.system() == "Windows":
+    if _IS_WINDOWS:
         try:
             mutex_name = f"Local\\{name}"
-            handle = ctypes.windll.kernel32.CreateMutexW(None, False, mutex_name)
-            last_error = ctypes.windll.kernel32.GetLastError()
-            _InstanceState.handle = handle
+            handle = _CreateMutexW(None, False, mutex_name)
+            last_error = ctypes.get_last_error()
             if last_error == ERROR_ALREADY_EXISTS:
+                # 已有实例：立即关闭句柄，避免本进程继续持有互斥对象
+                if handle:
+                    _CloseHandle(handle)
                 return False
+            _InstanceState.handle = handle
         except OSError:
             # 互斥创建异常不阻塞，继续进行文件锁
             pass
 
     # 2) 文件锁（跨平台可用），作为双保险
     try:
-        base_dir = os.getenv('LOCALAPPDATA') or gettempdir()
-        app_dir = Path(base_dir) / 'VerifyWifi'
-        app_dir.mkdir(parents=True, exist_ok=True)
-        lock_path = app_dir / 'app.lock'
+        APP_DATA_DIR.mkdir(parents=True, exist_ok=True)
+        lock_path = APP_DATA_DIR / 'app.lock'
         f = open(lock_path, 'a+')
         try:
             msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
@@ -402,32 +342,104 @@ def ensure_single_instance(name: str = "VerifyWifiSingleInstance") -> bool:
     except OSError:
         # 文件锁失败不影响，但可能导致双开；尽量通过互斥已拦截
         pass
+    atexit.register(_release_single_instance)
     return True
 
 
-def _acquire_udp_lock() -> bool:
-    """尝试绑定本地 UDP 端口作为系统级单实例锁。绑定成功即为首个实例。"""
+def _release_single_instance():
+    """释放单实例互斥句柄、文件锁与控制端口（退出或放弃启动时调用，可重复调用）"""
+    if _InstanceState.handle:
+        try:
+            _CloseHandle(_InstanceState.handle)
+        except (OSError, NameError):
+            pass
+        _InstanceState.handle = None
+    if _InstanceState.lock_file_handle is not None:
+        try:
+            _InstanceState.lock_file_handle.close()
+        except OSError:
+            pass
+        _InstanceState.lock_file_handle = None
+    if _InstanceState.control_sock is not None:
+        try:
+            _InstanceState.control_sock.close()
+        except OSError:
+            pass
+        _InstanceState.control_sock = None
+
+
+def _start_control_socket():
+    """绑定本地 UDP 控制端口，用于接收后续启动实例发来的激活信号。
+    单实例判定只由互斥与文件锁负责；绑定失败时仅缺少激活通知，返回 None。"""
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         s.bind(('127.0.0.1', CONTROL_UDP_PORT))
-        _InstanceState.control_sock = s
-        return True
     except OSError:
-        return False
+        return None
+    _InstanceState.control_sock = s
+    return s
 
+@functools.lru_cache(maxsize=1)
 def is_admin():
-    """检查当前脚本是否以管理员权限运行 (仅限Windows)"""
-    if platform.system() != "Windows":
+    """检查当前脚本是否以管理员权限运行 (仅限Windows)；进程内权限不变，只查询一次"""
+    if not _IS_WINDOWS:
         return False
     try:
-        return ctypes.windll.shell32.IsUserAnAdmin()
+        return bool(_IsUserAnAdmin())
     except OSError:
         return False
 
+# netsh 取系统目录下的绝对路径，CreateProcess 不再依次搜索程序目录/当前目录/PATH
+_NETSH = os.path.join(os.getenv('SystemRoot') or r'C:\Windows', 'System32', 'netsh.exe') if _IS_WINDOWS else 'netsh'
+_NETSH_RULE_CMD = [_NETSH, 'advfirewall', 'firewall']
+
+
+def _show_inbound_rules():
+    """一次列出全部入站规则，返回 {规则名: [各条同名规则的字段值集合]}；查询失败返回 None"""
+    # 直接以 argv 列表调用 netsh，不经过 cmd.exe
+    shown = subprocess.run(
+        _NETSH_RULE_CMD + ['show', 'rule', 'name=all', 'dir=in'],
+        capture_output=True,
+        text=True,
+        encoding='cp936',
+        errors='ignore',
+        check=False,
+        creationflags=CREATE_NO_WINDOW
+    )
+    if shown.returncode != 0:
+        return None
+    rules = {}
+    # 每条规则为一段：首行为规则名，第二行为分隔线；输出标签随系统语言变化，只取字段值
+    for block in re.split(r'\n\s*\n', shown.stdout):
+        lines = [line for line in block.splitlines() if line.strip()]
+        if len(lines) < 2 or not lines[1].startswith('---'):
+            continue
+        name = lines[0].partition(':')[2].strip()
+        values = {line.rpartition(':')[2].strip() for line in lines[2:] if ':' in line}
+        rules.setdefault(name, []).append(values)
+    return rules
+
+
+def _firewall_rule_commands(port: str, name: str, existing) -> List[str]:
+    """返回为单个端口重建入站规则所需的 netsh 脚本行；existing 为同名规则的字段值集合列表"""
+    # 已存在且端口一致时无需改动；同名规则多于一条时仍重建
+    if len(existing) == 1 and port in existing[0]:
+        print(f"   ✅ 端口 {port} 的入站规则已存在。")
+        return []
+    commands = []
+    if existing:
+        # 删除可能存在的旧规则以避免冲突
+        commands.append(f'advfirewall firewall delete rule name="{name}"')
+    # 为Python.exe创建特定的规则，更安全
+    commands.append(f'advfirewall firewall add rule name="{name}" dir=in action=allow '
+                    f'protocol=TCP localport={port}')
+    return commands
+
+
 def setup_firewall_rules():
     """自动配置Windows防火墙规则"""
-    if platform.system() != "Windows":
+    if not _IS_WINDOWS:
         print("ℹ️  非Windows系统，跳过防火墙配置。")
         return True
 
@@ -436,93 +448,215 @@ def setup_firewall_rules():
         "8888": "WiFi Auth Proxy (8888)",
         "8080": "WiFi Auth API (8080)"
     }
-    success = True
+    # 只启动一次 netsh 查询全部入站规则；查询失败时按规则不存在处理，只添加不删除
+    shown = _show_inbound_rules() or {}
+    pending = {}
     for port, name in rules.items():
-        # 删除可能存在的旧规则以避免冲突
-        subprocess.run(
-            f'netsh advfirewall firewall delete rule name="{name}"',
-            shell=True,
-            capture_output=True,
-            check=False
-        )
-        # 为Python.exe创建特定的规则，更安全
-        command = (
-            f'netsh advfirewall firewall add rule name="{name}" '
-            f'dir=in action=allow protocol=TCP localport={port}'
+        commands = _firewall_rule_commands(port, name, shown.get(name, []))
+        if commands:
+            pending[port] = commands
+    if not pending:
+        return True
+
+    # 全部删除/添加命令写入同一脚本，由一个 netsh 进程执行
+    script_path = Path(gettempdir()) / f'verifywifi_firewall_{os.getpid()}.txt'
+    try:
+        script_path.write_text(
+            '\n'.join(line for commands in pending.values() for line in commands) + '\n',
+            encoding='utf-8'
         )
         result = subprocess.run(
-            command,
-            shell=True,
+            _NETSH_RULE_CMD[:1] + ['-f', str(script_path)],
             capture_output=True,
             text=True,
             encoding='cp936',
             errors='ignore',
-            check=False
+            check=False,
+            creationflags=CREATE_NO_WINDOW
         )
-        if result.returncode == 0:
+    finally:
+        try:
+            script_path.unlink()
+        except OSError:
+            pass
+    if result.returncode == 0:
+        for port in pending:
             print(f"   ✅ 已为端口 {port} 添加入站规则。")
-        else:
-            print(f"   ⚠️  为端口 {port} 添加防火墙规则失败: {result.stderr or result.stdout}")
-            success = False
-    return success
+        return True
+    print(f"   ⚠️  为端口 {'/'.join(pending)} 添加防火墙规则失败: {result.stderr or result.stdout}")
+    return False
 
+# RFC1918 + 常见 CGNAT 网段，按 (网络号, 掩码) 的 32 位整数比较
+PRIVATE_NETS = (
+    (0x0A000000, 0xFF000000),  # 10.0.0.0/8
+    (0xAC100000, 0xFFF00000),  # 172.16.0.0/12
+    (0xC0A80000, 0xFFFF0000),  # 192.168.0.0/16
+    (0x64400000, 0xFFC00000),  # 100.64.0.0/10 (CGNAT)
+)
+
+
+def _is_private_ip32(n: int) -> bool:
+    return any((n & mask) == base for base, mask in PRIVATE_NETS)
+
+
+@functools.lru_cache(maxsize=256)
 def _is_private_ipv4(ip: str) -> bool:
-    # RFC1918 + 常见 CGNAT 网段
     try:
-        parts = [int(p) for p in ip.split('.')]
-        if len(parts) != 4:
-            return False
-        a, b = parts[0], parts[1]
-        if a == 10:
-            return True
-        if a == 172 and 16 <= b <= 31:
-            return True
-        if a == 192 and b == 168:
-            return True
-        # CGNAT 100.64.0.0/10
-        if a == 100 and 64 <= b <= 127:
-            return True
-        return False
-    except ValueError:
+        n = struct.unpack('!I', socket.inet_pton(socket.AF_INET, ip))[0]
+    except (OSError, TypeError):
         return False
+    return _is_private_ip32(n)
+
+
+_VPN_KEYWORDS_RE = re.compile(
+    'vpn|anyconnect|ppp|pptp|l2tp|ikev2|wireguard|wg|'
+    'zerotier|tailscale|tun|tap|vmware|virtual|hyper-v',
+    re.IGNORECASE
+)
+_PREFERRED_IF_RE = re.compile('wlan|wi-fi|ethernet|以太网|无线', re.IGNORECASE)
 
 
 def _looks_like_vpn_or_virtual(name: str) -> bool:
-    lower = name.lower()
-    keywords = [
-        'vpn', 'anyconnect', 'ppp', 'pptp', 'l2tp', 'ikev2', 'wireguard', 'wg',
-        'zerotier', 'tailscale', 'tun', 'tap', 'vmware', 'virtual', 'hyper-v'
-    ]
-    return any(k in lower for k in keywords)
+    return _VPN_KEYWORDS_RE.search(name) is not None
+
+
+class _SOCKADDR_IN(ctypes.Structure):
+    _fields_ = [('sin_family', ctypes.c_ushort), ('sin_port', ctypes.c_ushort),
+                ('sin_addr', ctypes.c_ubyte * 4), ('sin_zero', ctypes.c_char * 8)]
+
+
+class _SOCKET_ADDRESS(ctypes.Structure):
+    _fields_ = [('lpSockaddr', ctypes.POINTER(_SOCKADDR_IN)), ('iSockaddrLength', ctypes.c_int)]
+
+
+class _IP_ADAPTER_UNICAST_ADDRESS(ctypes.Structure):
+    pass
+
+
+_IP_ADAPTER_UNICAST_ADDRESS._fields_ = [
+    ('Length', ctypes.c_uint32), ('Flags', ctypes.c_uint32),
+    ('Next', ctypes.POINTER(_IP_ADAPTER_UNICAST_ADDRESS)),
+    ('Address', _SOCKET_ADDRESS),
+]
+
+
+class _IP_ADAPTER_ADDRESSES(ctypes.Structure):
+    """IP_ADAPTER_ADDRESSES_LH 的前缀部分，只声明到 OperStatus（结构体只通过指针访问）"""
+
+
+_IP_ADAPTER_ADDRESSES._fields_ = [
+    ('Length', ctypes.c_uint32), ('IfIndex', ctypes.c_uint32),
+    ('Next', ctypes.POINTER(_IP_ADAPTER_ADDRESSES)),
+    ('AdapterName', ctypes.c_char_p),
+    ('FirstUnicastAddress', ctypes.POINTER(_IP_ADAPTER_UNICAST_ADDRESS)),
+    ('FirstAnycastAddress', ctypes.c_void_p),
+    ('FirstMulticastAddress', ctypes.c_void_p),
+    ('FirstDnsServerAddress', ctypes.c_void_p),
+    ('DnsSuffix', ctypes.c_wchar_p),
+    ('Description', ctypes.c_wchar_p),
+    ('FriendlyName', ctypes.c_wchar_p),
+    ('PhysicalAddress', ctypes.c_ubyte * 8),
+    ('PhysicalAddressLength', ctypes.c_uint32),
+    ('Flags', ctypes.c_uint32),
+    ('Mtu', ctypes.c_uint32),
+    ('IfType', ctypes.c_uint32),
+    ('OperStatus', ctypes.c_int),
+]
+
+_GAA_FLAGS = 0x0002 | 0x0004 | 0x0008  # SKIP_ANYCAST | SKIP_MULTICAST | SKIP_DNS_SERVER
+_ERROR_BUFFER_OVERFLOW = 111
+_IF_OPER_STATUS_UP = 1
+
+
+def _win_ipv4_interfaces():
+    """直接调用 GetAdaptersAddresses 枚举已启用网卡的IPv4地址，返回 [(网卡友好名, [(IP整数, ip), ...])]；失败返回 None"""
+    size = wintypes.ULONG(16384)
+    for _ in range(3):
+        buf = ctypes.create_string_buffer(size.value)
+        ret = _GetAdaptersAddresses(socket.AF_INET, _GAA_FLAGS, None, buf, ctypes.byref(size))
+        if ret != _ERROR_BUFFER_OVERFLOW:
+            break
+    if ret != 0:
+        return None
+    interfaces = []
+    adapter = ctypes.cast(buf, ctypes.POINTER(_IP_ADAPTER_ADDRESSES))
+    while adapter:
+        info = adapter.contents
+        if info.OperStatus == _IF_OPER_STATUS_UP:
+            addrs = []
+            unicast = info.FirstUnicastAddress
+            while unicast:
+                sockaddr = unicast.contents.Address.lpSockaddr
+                if sockaddr and sockaddr.contents.sin_family == socket.AF_INET:
+                    packed = bytes(sockaddr.contents.sin_addr)
+                    addrs.append((struct.unpack('!I', packed)[0], socket.inet_ntoa(packed)))
+                unicast = unicast.contents.Next
+            interfaces.append((info.FriendlyName or '', addrs))
+        adapter = info.Next
+    return interfaces
+
+
+def _psutil_ipv4_interfaces():
+    """通过 psutil 枚举已启用网卡的IPv4地址，格式同 _win_ipv4_interfaces；psutil 不可用返回 None"""
+    psutil = _optional_import('psutil')
+    if psutil is None:
+        return None
+    try:
+        stats = psutil.net_if_stats()
+    except OSError:
+        stats = {}
+    interfaces = []
+    for if_name, addrs in psutil.net_if_addrs().items():
+        # 先跳过未启用的网卡（取不到状态的网卡仍参与评分）
+        stat = stats.get(if_name)
+        if stat is not None and not stat.isup:
+            continue
+        ipv4 = []
+        for addr in addrs:
+            if addr.family != socket.AF_INET:
+                continue
+            try:
+                ipv4.append((struct.unpack('!I', socket.inet_aton(addr.address))[0], addr.address))
+            except OSError:
+                continue
+        interfaces.append((if_name, ipv4))
+    return interfaces
+
+
+@functools.lru_cache(maxsize=1)
+def _scan_interfaces() -> Tuple[Tuple[int, int, str, str], ...]:
+    """枚举一次网卡，返回按优先级降序的 (score, IP的32位整数, ip, 网卡名)。
+    已排除VPN/虚拟网卡、回环与链路本地地址；网卡变化后需与 get_local_ip 一同 cache_clear()。
+    Windows 下直接调用 GetAdaptersAddresses，无需导入 psutil；失败时再回退 psutil。"""
+    interfaces = None
+    if _IS_WINDOWS:
+        try:
+            interfaces = _win_ipv4_interfaces()
+        except (OSError, ValueError):
+            interfaces = None
+    if interfaces is None:
+        interfaces = _psutil_ipv4_interfaces() or ()
+    candidates = []
+    for if_name, addrs in interfaces:
+        if _looks_like_vpn_or_virtual(if_name):
+            continue
+        score = 10 if _PREFERRED_IF_RE.search(if_name) else 0
+        for n, ip in addrs:
+            # 排除回环 127.0.0.0/8 与链路本地 169.254.0.0/16
+            if n >> 24 == 127 or n & 0xFFFF0000 == 0xA9FE0000:
+                continue
+            candidates.append((score, n, ip, if_name))
+    candidates.sort(reverse=True)
+    return tuple(candidates)
 
 
+@functools.lru_cache(maxsize=1)
 def get_local_ip():
     """优先选择物理网卡的私网IPv4，避开VPN/虚拟网卡；否则回退socket路由；再回退127.0.0.1。"""
     # 1) 使用 psutil 精选网卡
-    try:
-        import importlib
-        psutil = importlib.import_module('psutil')
-        preferred_keywords = ['wlan', 'wi-fi', 'ethernet', '以太网', '无线']
-        candidates = []
-        for if_name, addrs in psutil.net_if_addrs().items():
-            if _looks_like_vpn_or_virtual(if_name):
-                continue
-            score = 0
-            lname = if_name.lower()
-            if any(k in lname for k in preferred_keywords):
-                score += 10
-            for addr in addrs:
-                if addr.family == socket.AF_INET:
-                    ip = addr.address
-                    if ip.startswith('127.') or ip.startswith('169.254.'):
-                        continue
-                    if _is_private_ipv4(ip):
-                        candidates.append((score, ip))
-        if candidates:
-            candidates.sort(reverse=True)
-            return candidates[0][1]
-    except (ModuleNotFoundError, ImportError):
-        pass
+    for _score, n, ip, _if_name in _scan_interfaces():
+        if _is_private_ip32(n):
+            return ip
 
     # 2) 路由法（可能返回VPN出口）
     try:
@@ -539,37 +673,59 @@ def get_local_ip():
     # 3) 兜底
     return "127.0.0.1"
 
-def check_port(host, port, timeout=15):
-    """检查端口是否开放"""
+LOCAL_IP_TTL = 30  # 交互入口复用本机IP的时长（秒）
+_local_ip_at = 0.0  # 最近一次枚举网卡的 monotonic 时间，0 表示需要重新枚举
+
+
+def current_local_ip() -> str:
+    """返回本机IP；距上次枚举超过 LOCAL_IP_TTL 秒时清空缓存重新枚举网卡"""
+    global _local_ip_at
+    now = time.monotonic()
+    if not _local_ip_at or now - _local_ip_at >= LOCAL_IP_TTL:
+        _scan_interfaces.cache_clear()
+        get_local_ip.cache_clear()
+        _local_ip_at = now
+    return get_local_ip()
+
+
+def invalidate_local_ip():
+    """标记本机IP需要重新枚举（网络可能已变化）"""
+    global _local_ip_at
+    _local_ip_at = 0.0
+
+
+def check_port(host, port, timeout=0.2):
+    """检查端口是否开放（被拒绝时立即返回，无响应时最多等待 timeout 秒，交由退避轮询重试）"""
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.settimeout(timeout)
-            result = sock.connect_ex((host, port))
-            print(f"检查端口 {host}:{port} 结果: {result}")
-            return result == 0
+        with socket.create_connection((host, port), timeout=timeout):
+            print(f"检查端口 {host}:{port} 已就绪")
+            return True
     except OSError:
         return False
 
+def check_proxy_port(local_ip):
+    """代理就绪检查：先探测回环地址，不通时再探测本机局域网IP"""
+    return check_port("127.0.0.1", 8888) or check_port(local_ip, 8888)
+
 def wait_for_service(name, check_func, max_wait=30):
-    """等待服务启动"""
+    """等待服务启动：轮询间隔从 20ms 起指数增长到 100ms，服务就绪后尽快返回"""
     print(f"⏳ 等待 {name} 启动...")
-    for i in range(max_wait):
+    start = time.monotonic()
+    deadline = start + max_wait
+    next_notice = start + 5
+    delay = 0.02
+    while True:
         if check_func(): print(f"✅ {name} 启动成功"); return True
-        time.sleep(1)
-        if i % 5 == 4: print(f"   仍在等待 {name}... ({i+1}/{max_wait}s)")
+        now = time.monotonic()
+        if now >= deadline:
+            break
+        if now >= next_notice:
+            print(f"   仍在等待 {name}... ({int(now - start)}/{max_wait}s)")
+            next_notice += 5
+        time.sleep(min(delay, deadline - now))
+        delay = min(delay * 2, 0.1)
     print(f"❌ {name} 启动超时"); return False
 
-def stream_output(pipe, log_file_path):
-    """将子进程的输出流式传输到日志文件"""
-    try:
-        with open(log_file_path, 'w', encoding='utf-8') as f:
-            for line in iter(pipe.readline, ''):
-                f.write(line)
-                f.flush()
-    except OSError:
-        pass # 进程终止时可能出现管道关闭错误，可以忽略
-
-
 def _send_activate_signal():
     """向已运行实例发送激活信号。"""
     try:
@@ -587,7 +743,7 @@ def _run_api_server():
     from src.pyserver import auth_api as _api
     port = int(os.environ.get('PORT', 8080))
     _api.logger.info(f"WiFi认证API服务启动: 端口={port}, 调试模式=False")
-    _api.app.run(host='0.0.0.0', port=port, debug=False, threaded=True)
+    _api.serve(host='0.0.0.0', port=port)
 
 
 def _run_proxy_server(host: str, port: int):
@@ -604,13 +760,7 @@ def _run_proxy_server(host: str, port: int):
 
 def main():
     def _can_build_tray() -> bool:
-        try:
-            import importlib
-            importlib.import_module('pystray')
-            importlib.import_module('PIL.Image')
-            return True
-        except ImportError:
-            return False
+        return _module_available('pystray') and _module_available('PIL.Image')
     parser = argparse.ArgumentParser(description="WiFi二次认证系统一键启动（纯Python）")
     parser.add_argument('--role', choices=['api', 'proxy'], help='内部工作角色（打包后子进程使用）')
     parser.add_argument('--host', default='0.0.0.0', help='代理监听地址（仅 --role=proxy 时有效）')
@@ -629,104 +779,102 @@ def main():
     # 仅防火墙提权模式：管理员执行后立即退出
     if args.elevate_firewall:
         ok = setup_firewall_rules()
-        # 写入标记文件，避免后续重复提权
-        try:
-            base_dir = os.getenv('LOCALAPPDATA') or gettempdir()
-            app_dir = Path(base_dir) / 'VerifyWifi'
-            app_dir.mkdir(parents=True, exist_ok=True)
-            (app_dir / 'firewall.ok').write_text('ok', encoding='utf-8')
-        except OSError:
-            pass
+        # 写入注册表标记，避免后续重复提权（注册表仅 Windows 可用）
+        if _IS_WINDOWS:
+            try:
+                with winreg.CreateKey(winreg.HKEY_CURRENT_USER, _FIREWALL_REG_KEY) as key:
+                    winreg.SetValueEx(key, _FIREWALL_REG_VALUE, 0, winreg.REG_DWORD, 1)
+            except OSError:
+                pass
         sys.exit(0 if ok else 1)
 
     # 常规模式：主进程不提权。仅当未配置过防火墙时，后台发起一次性提权子进程执行 --elevate-firewall
-    if platform.system() == "Windows" and not is_admin():
+    # 已自行管理防火墙的环境（如CI、已提权控制台）可设置 WIFI_AUTH_SKIP_ELEVATION=1 跳过提权
+    if _IS_WINDOWS and not os.environ.get('WIFI_AUTH_SKIP_ELEVATION') and not is_admin():
         need_firewall = True
         try:
-            base_dir = os.getenv('LOCALAPPDATA') or gettempdir()
-            app_dir = Path(base_dir) / 'VerifyWifi'
-            marker = app_dir / 'firewall.ok'
-            need_firewall = not marker.exists()
+            with winreg.OpenKey(winreg.HKEY_CURRENT_USER, _FIREWALL_REG_KEY) as key:
+                winreg.QueryValueEx(key, _FIREWALL_REG_VALUE)
+            need_firewall = False
         except OSError:
             pass
         if need_firewall:
             try:
-                is_frozen = bool(getattr(sys, "frozen", False))
-                if is_frozen:
-                    exe_path = sys.executable
-                    workdir = str(Path(exe_path).parent.resolve())
-                    ctypes.windll.shell32.ShellExecuteW(None, "runas", exe_path, "--elevate-firewall", workdir, 0)
-                else:
-                    try:
-                        script_path = os.path.abspath(__file__)
-                    except NameError:
-                        script_path = sys.argv[0]
-                    workdir = str(Path(script_path).parent.resolve())
-                    params = subprocess.list2cmdline([script_path, "--elevate-firewall"])
-                    ctypes.windll.shell32.ShellExecuteW(None, "runas", sys.executable, params, workdir, 0)
+                # 复用模块加载时确定的子进程入口（打包后为自身exe，开发环境为 python + 脚本路径）
+                exe_path = _SELF_ARGV[0]
+                workdir = str(Path(_SELF_ARGV[-1]).parent)
+                params = subprocess.list2cmdline(list(_SELF_ARGV[1:]) + ["--elevate-firewall"])
+                _ShellExecuteW(None, "runas", exe_path, params, workdir, 0)
             except OSError:
                 pass
 
     # 后台模式已取消：关闭控制台仅隐藏，不再派生新进程
 
     # Single-instance guard (after elevation)
-    if not ensure_single_instance() or not _acquire_udp_lock():
+    if not ensure_single_instance():
+        _release_single_instance()
         _send_activate_signal()
         try:
-            ctypes.windll.user32.MessageBoxW(0, "程序已在运行中。", "WiFi认证系统", 0x00000040)
-        except OSError:
+            _MessageBoxW(None, "程序已在运行中。", "WiFi认证系统", 0x00000040)
+        except (OSError, NameError):
             print("程序已在运行中。")
         return
+    _start_control_socket()
 
     print("=" * 60)
     print("🎉 WiFi二次认证系统 - 启动程序")
     print("=" * 60)
     # 防火墙配置已由一次性提权子进程处理；此处不再阻塞
     
-    project_root = Path(__file__).parent
-    log_dir = project_root / "logs"
+    log_dir = LOG_DIR
     log_dir.mkdir(exist_ok=True)
     
     processes: List[Tuple[str, subprocess.Popen]] = []
-    threads = []
-    local_ip = get_local_ip()
+    log_files = []
+    local_ip = current_local_ip()
     
-    env = os.environ.copy()
-    env["PYTHONIOENCODING"] = "UTF-8"
+    # 子进程直接写日志文件，不缓冲输出，日志实时可见
+    env = {**os.environ, "PYTHONIOENCODING": "UTF-8", "PYTHONUNBUFFERED": "1"}
     
     # --- Windows 控制台关闭 -> 隐藏到托盘，仅托盘“退出”才真正退出 ---
     def _hide_console_window():
-        if platform.system() == 'Windows':
+        if _IS_WINDOWS:
             try:
-                hwnd = ctypes.windll.kernel32.GetConsoleWindow()
+                hwnd = _GetConsoleWindow()
                 if hwnd:
-                    ctypes.windll.user32.ShowWindow(hwnd, 0)  # SW_HIDE = 0
+                    _ShowWindow(hwnd, 0)  # SW_HIDE = 0
             except OSError:
                 pass
 
+    # 托盘“退出”与控制台 Ctrl+C 都通过该事件通知主线程退出
+    exit_event = _WakeupEvent()
+
     _console_handler_ref = None
-    if platform.system() == 'Windows':
+    if _IS_WINDOWS:
         try:
-            HandlerRoutine = ctypes.WINFUNCTYPE(ctypes.c_bool, ctypes.c_uint)
             def _handler(ctrl_type):
+                # CTRL_C/CTRL_BREAK -> 通知主线程退出；Windows 上阻塞中的 Event.wait() 收不到 KeyboardInterrupt
+                if ctrl_type in (0, 1):
+                    print("\n用户中断，开始关闭服务...")
+                    exit_event.set()
+                    return True
                 # CTRL_CLOSE/LOGOFF/SHUTDOWN -> 仅隐藏控制台，托盘与服务保持
                 if ctrl_type in (2, 5, 6):
                     _hide_console_window()
                     try:
-                        ctypes.windll.kernel32.FreeConsole()
+                        _FreeConsole()
                     except OSError:
                         pass
                     return True
                 return False
-            _console_handler_ref = HandlerRoutine(_handler)
-            ctypes.windll.kernel32.SetConsoleCtrlHandler(_console_handler_ref, True)
+            _console_handler_ref = _HandlerRoutine(_handler)
+            _SetConsoleCtrlHandler(_console_handler_ref, True)
         except OSError:
             _console_handler_ref = None
 
     # 预先创建托盘并后台运行，确保任何时刻都可见
-    exit_event = threading.Event()
     tray = None
-    if platform.system() == 'Windows':
+    if _IS_WINDOWS:
         tray = build_tray(exit_event=exit_event)
         if tray is not None:
             try:
@@ -743,70 +891,38 @@ def main():
                 tray = None
                 print('⚠️ 托盘创建失败，将无托盘运行。')
 
-    # 启动UDP控制监听线程：接受ACTIVATE以显示通知（提示程序已运行）
-    def _control_server():
-        if _InstanceState.control_sock is None:
-            return
-        s = _InstanceState.control_sock
-        while True:
-            try:
-                data, _ = s.recvfrom(32)
-            except OSError:
-                break
-            if data == b'ACTIVATE':
-                try:
-                    if tray is not None:
-                        tray.notify('程序已在运行。')
-                except Exception:
-                    pass
-
-    threading.Thread(target=_control_server, daemon=True).start()
-
     try:
         # 仅启动 API 与 代理。打包后用自身exe作为子进程入口，通过 --role 分派
-        is_frozen = bool(getattr(sys, 'frozen', False))
-        if is_frozen:
-            exe_or_py = [sys.executable]
-        else:
-            # 开发环境用 python + 脚本路径
-            script_path = os.path.abspath(__file__)
-            exe_or_py = [sys.executable, script_path]
-        
         services = {
             "API服务器": {
-                "command": exe_or_py + ["--role", "api"],
-                "check": lambda: check_port("localhost", 8080),
+                "command": _API_ARGV,
+                "check": functools.partial(check_port, "localhost", 8080),
                 "log_file": log_dir / "auth_api.log"
             },
             "代理服务器": {
-                "command": exe_or_py + ["--role", "proxy", "--host", "0.0.0.0", "--port", "8888"],
-                "check": lambda: (check_port("127.0.0.1", 8888) or check_port(local_ip, 8888)),
+                "command": _PROXY_ARGV,
+                "check": functools.partial(check_proxy_port, local_ip),
                 "log_file": log_dir / "wifi_proxy.log"
             }
         }
 
         for name, config in services.items():
             print(f"🚀 启动 {name}...")
+            # 日志文件句柄直接交给子进程继承，输出由子进程写入，主进程不再转发
+            log_file = open(config["log_file"], 'wb')
+            log_files.append(log_file)
             process = subprocess.Popen(
                 config["command"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                encoding='utf-8',
-                errors='replace',
+                stdout=log_file,
+                stderr=subprocess.STDOUT,
                 env=env,
-                shell=config.get("shell", False),
-                cwd=str(project_root),
+                cwd=_PROJECT_ROOT_STR,
                 creationflags=CREATE_NO_WINDOW
             )
             processes.append((name, process))
 
-            stdout_thread = threading.Thread(target=stream_output, args=(process.stdout, config["log_file"]))
-            stderr_thread = threading.Thread(target=stream_output, args=(process.stderr, config["log_file"]))
-            stdout_thread.daemon = True; stderr_thread.daemon = True
-            threads.extend([stdout_thread, stderr_thread])
-            stdout_thread.start(); stderr_thread.start()
-            
+        # 两个服务互不依赖，全部启动后再逐个等待就绪，总耗时取决于较慢的一个
+        for name, config in services.items():
             if not wait_for_service(name, config["check"], max_wait=60):
                 raise RuntimeError(f"{name}启动失败")
 
@@ -817,38 +933,45 @@ def main():
         print(f"  • 认证页面(后端HTML): http://{local_ip}:8080/api/auth/fallback")
         print(f"  • API健康检查: http://{local_ip}:8080/api/health")
         # 输出候选IP，帮助在VPN/虚拟网卡存在时手动选择
-        try:
-            import importlib
-            psutil = importlib.import_module('psutil')
-            all_ips = []
-            for if_name, addrs in psutil.net_if_addrs().items():
-                if _looks_like_vpn_or_virtual(if_name):
-                    continue
-                for addr in addrs:
-                    if addr.family == socket.AF_INET:
-                        ip = addr.address
-                        if not ip.startswith('127.') and not ip.startswith('169.254.'):
-                            all_ips.append(ip)
-            if all_ips:
-                print("\n🔎 检测到以下可能可用的IPv4（已排除VPN/虚拟网卡/回环）：")
-                for ip in sorted(set(all_ips)):
-                    note = " ← 当前选择" if ip == local_ip else ""
-                    print(f"  • {ip}{note}")
-        except (ModuleNotFoundError, ImportError):
-            pass
+        # 复用启动时的网卡枚举结果，不再重复扫描
+        all_ips = {n: ip for _score, n, ip, _if_name in _scan_interfaces()}
+        if all_ips:
+            print("\n🔎 检测到以下可能可用的IPv4（已排除VPN/虚拟网卡/回环）：")
+            # 按数值排序（字符串排序会把 10.x 排在 9.x 之前）
+            for _n, ip in sorted(all_ips.items()):
+                note = " ← 当前选择" if ip == local_ip else ""
+                print(f"  • {ip}{note}")
         print("\n📱 手机代理设置：")
         print(f"  • 代理服务器: {local_ip}")
         print("  • 端口: 8888")
         print("\n按 Ctrl+C 停止所有服务...")
         print("=" * 60)
         
-        # 主线程等待托盘退出事件；若托盘不可用，则保持运行
-        if tray is not None:
-            while not exit_event.is_set():
-                time.sleep(0.2)
-        else:
-            while True:
-                time.sleep(1)
+        # 主线程阻塞等待退出事件（托盘退出或 Ctrl+C），同时在 UDP 控制端口上接收 ACTIVATE，
+        # 期间不再定时唤醒；若托盘不可用，则运行至 Ctrl+C
+        # 未能注册控制台处理函数时，保留低频超时以便 Ctrl+C 仍能打断等待
+        wait_timeout = None if (_console_handler_ref is not None or not _IS_WINDOWS) else 1
+        control = _InstanceState.control_sock
+        while not exit_event.is_set():
+            if control is None:
+                exit_event.wait(wait_timeout)
+                continue
+            readable, _, _ = select.select([control, exit_event.wake_r], [], [], wait_timeout)
+            if control not in readable:
+                continue
+            try:
+                data, _ = control.recvfrom(32)
+            except OSError:
+                control = None  # 控制端口失效：不再接收激活信号，仅等待退出
+                continue
+            if data == b'ACTIVATE':
+                # 用户再次启动程序时网络可能已切换，下次打开认证页面时重新探测IP
+                invalidate_local_ip()
+                try:
+                    if tray is not None:
+                        tray.notify('程序已在运行。')
+                except Exception:
+                    pass
             
     except KeyboardInterrupt:
         print("\n用户中断，开始关闭服务...")
@@ -867,6 +990,11 @@ def main():
                     print(f"   ⚠️  强制停止 {name} 时出错: {ex}")
                     process.kill()
             print("✅ 所有服务已停止")
+        for log_file in log_files:
+            try:
+                log_file.close()
+            except OSError:
+                pass
         
         # 不再阻塞等待按键，避免“按回车才继续”的卡顿
 
@@ -875,9 +1003,9 @@ def _excepthook(exc_type, exc, tb):
     import traceback
     traceback.print_exception(exc_type, exc, tb)
     # Windows下弹窗提示
-    if platform.system() == 'Windows':
+    if _IS_WINDOWS:
         try:
-            ctypes.windll.user32.MessageBoxW(0, str(exc), "WiFi认证启动失败", 0x00000010)
+            _MessageBoxW(None, str(exc), "WiFi认证启动失败", 0x00000010)
         except OSError:
             pass
 
@@ -11,6 +11,8 @@ a = Analysis(
     hiddenimports=[
         'flask',
         'flask_cors', 
+        'orjson',
+        'waitress',
         'psutil',
         'pystray',
         'win32api','win32con','win32gui',
@@ -36,7 +38,7 @@ exe = EXE(
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
+    upx=False,  # UPX 压缩的 DLL 在每个进程（启动器 + 两个 --role 子进程）启动时都要解压，关闭以缩短启动
     upx_exclude=[],
     runtime_tmpdir=None,
     console=True,  # 改为False，避免显示控制台窗口